@@ -0,0 +1,373 @@
+"""
+Audit trail of logins, registrations, role changes and webhook outcomes.
+
+Recording an event only appends a tuple to an in-memory buffer, so it never
+adds a commit to the request path. A background task drains the buffer every
+AUDIT_FLUSH_SECONDS and writes it in batches, either with one bulk insert
+into `audit_events` or as gzip-compressed NDJSON appended to a rotating log
+file (AUDIT_SINK=database|file). With the file sink every process writes its
+own file (hostname and pid are added to AUDIT_LOG_PATH), so workers never
+append to or rotate the same file; read_log_files merges them.
+
+The buffer is bounded: when the writer falls behind (or the sink is down) new
+events are dropped and counted rather than growing memory without limit.
+Batch jobs that change thousands of users at once (reconciliation, the expiry
+sweeper) use record_in_transaction instead, so a normal run never overflows it.
+"""
+
+import asyncio
+import collections
+import csv
+import glob
+import gzip
+import heapq
+import io
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import AuditEvent
+
+logger = logging.getLogger(__name__)
+
+AUDIT_SINK = os.getenv("AUDIT_SINK", "database")
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1"))
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "audit.ndjson.gz")
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+AUDIT_LOG_BACKUPS = int(os.getenv("AUDIT_LOG_BACKUPS", "10"))
+
+FIELDS = ["created_at", "event_type", "outcome", "user_id", "email", "ip_address", "details"]
+
+
+class AuditEntry(NamedTuple):
+    created_at: datetime
+    event_type: str
+    outcome: str
+    user_id: Optional[int]
+    email: Optional[str]
+    ip_address: Optional[str]
+    details: Optional[dict]
+
+    def as_dict(self) -> dict:
+        return {
+            "created_at": self.created_at.isoformat(),
+            "event_type": self.event_type,
+            "outcome": self.outcome,
+            "user_id": self.user_id,
+            "email": self.email,
+            "ip_address": self.ip_address,
+            "details": self.details,
+        }
+
+
+def audit_entry(
+    event_type: str,
+    outcome: str = "success",
+    user_id: Optional[int] = None,
+    email: Optional[str] = None,
+    ip_address: Optional[str] = None,
+    **details,
+) -> AuditEntry:
+    return AuditEntry(
+        datetime.utcnow(), event_type, outcome, user_id, email, ip_address, details or None
+    )
+
+
+class AuditLog:
+    """
+    Bounded buffer of events waiting to be written.
+
+    Producers never take a lock: deque.append/popleft are atomic, and the size
+    check may overshoot the capacity by at most one event per concurrent
+    producer. Only the writer drains it.
+    """
+
+    def __init__(self, capacity: int = AUDIT_BUFFER_SIZE):
+        self.capacity = capacity
+        self._events: collections.deque = collections.deque()
+        # Health counters; unsynchronised, so they may undercount under
+        # heavy contention between threads
+        self.dropped = 0
+        self.written = 0
+
+    def record(
+        self,
+        event_type: str,
+        outcome: str = "success",
+        user_id: Optional[int] = None,
+        email: Optional[str] = None,
+        ip_address: Optional[str] = None,
+        **details,
+    ) -> bool:
+        """Queue an event; returns False if it was dropped because the buffer is full"""
+        if len(self._events) >= self.capacity:
+            self.dropped += 1
+            return False
+        self._events.append(
+            audit_entry(event_type, outcome, user_id, email, ip_address, **details)
+        )
+        return True
+
+    def drain(self, limit: int) -> list:
+        """Take up to `limit` of the oldest pending events"""
+        batch = []
+        popleft = self._events.popleft
+        try:
+            while len(batch) < limit:
+                batch.append(popleft())
+        except IndexError:
+            pass
+        return batch
+
+    def restore(self, batch: list):
+        """Put a batch back at the front after a failed write (space permitting)"""
+        for entry in reversed(batch):
+            if len(self._events) >= self.capacity:
+                self.dropped += 1
+                continue
+            self._events.appendleft(entry)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._events),
+            "capacity": self.capacity,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+audit_log = AuditLog()
+
+
+def client_ip(request) -> Optional[str]:
+    return request.client.host if request is not None and request.client else None
+
+
+def _write_database(batch: list):
+    db = SessionLocal()
+    try:
+        db.execute(insert(AuditEvent), [entry._asdict() for entry in batch])
+        db.commit()
+    finally:
+        db.close()
+
+
+# Rotation and appends from the flush task and after-commit hooks in this
+# process; other processes write their own files
+_file_lock = threading.Lock()
+
+
+def _split_log_path(path: str) -> tuple:
+    """audit.ndjson.gz -> ("audit", ".ndjson.gz"), keeping the directory"""
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition(".")
+    return os.path.join(directory, stem), dot + suffix
+
+
+def process_log_path(path: str = AUDIT_LOG_PATH) -> str:
+    """This process's own log file, e.g. audit-web1-4242.ndjson.gz"""
+    stem, suffix = _split_log_path(path)
+    # Looked up on every write so a forked worker never shares its parent's file
+    return f"{stem}-{socket.gethostname()}-{os.getpid()}{suffix}"
+
+
+def _rotate(path: str, backups: int):
+    """Shift path -> path.1 -> path.2 ..., discarding the oldest"""
+    for index in range(backups - 1, 0, -1):
+        source = f"{path}.{index}"
+        if os.path.exists(source):
+            os.replace(source, f"{path}.{index + 1}")
+    if backups > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+
+def _write_file(batch: list, path: Optional[str] = None):
+    path = path or process_log_path()
+    lines = "".join(json.dumps(entry.as_dict()) + "\n" for entry in batch)
+    # One complete gzip member per batch, appended with a single write; gzip
+    # readers treat consecutive members as one stream
+    blob = gzip.compress(lines.encode("utf-8"))
+    with _file_lock:
+        if os.path.exists(path) and os.path.getsize(path) >= AUDIT_LOG_MAX_BYTES:
+            _rotate(path, AUDIT_LOG_BACKUPS)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = os.write(fd, blob)
+        finally:
+            os.close(fd)
+    if written != len(blob):
+        raise OSError(f"Short write to {path}: {written} of {len(blob)} bytes")
+
+
+def record_in_transaction(db: Session, entries: list, sink: str = AUDIT_SINK):
+    """
+    Audit a batch job's events without going through the bounded buffer.
+
+    With the database sink the rows are inserted in the caller's transaction,
+    so they commit (or roll back, e.g. on a dry run) with the change itself.
+    With the file sink they are appended once the caller commits.
+    """
+    if not entries:
+        return
+    if sink == "file":
+        def write(session):
+            for start in range(0, len(entries), AUDIT_BATCH_SIZE):
+                _write_file(entries[start:start + AUDIT_BATCH_SIZE])
+        event.listen(db, "after_commit", write, once=True)
+        return
+    for start in range(0, len(entries), AUDIT_BATCH_SIZE):
+        db.execute(
+            insert(AuditEvent),
+            [entry._asdict() for entry in entries[start:start + AUDIT_BATCH_SIZE]],
+        )
+
+
+def flush_audit(log: AuditLog = audit_log, sink: str = AUDIT_SINK) -> int:
+    """Write every pending event in batches; returns events written"""
+    write = _write_file if sink == "file" else _write_database
+    total = 0
+    while True:
+        batch = log.drain(AUDIT_BATCH_SIZE)
+        if not batch:
+            return total
+        try:
+            write(batch)
+        except Exception:
+            log.restore(batch)
+            raise
+        log.written += len(batch)
+        total += len(batch)
+
+
+async def audit_flush_loop():
+    """Flush audit events every AUDIT_FLUSH_SECONDS until cancelled"""
+    reported = 0
+    while True:
+        await asyncio.sleep(AUDIT_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_audit)
+        except Exception:
+            logger.exception("Audit flush failed")
+        if audit_log.dropped > reported:
+            logger.warning(
+                "Audit buffer full: dropped %d events (%d total)",
+                audit_log.dropped - reported, audit_log.dropped,
+            )
+            reported = audit_log.dropped
+
+
+def query_events(
+    db: Session,
+    event_type: Optional[str] = None,
+    outcome: Optional[str] = None,
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = 1000,
+) -> Iterator[dict]:
+    """Stream stored events (oldest first) from audit_events"""
+    query = select(AuditEvent.id, *[getattr(AuditEvent, name) for name in FIELDS])
+    if event_type:
+        query = query.where(AuditEvent.event_type == event_type)
+    if outcome:
+        query = query.where(AuditEvent.outcome == outcome)
+    if user_id is not None:
+        query = query.where(AuditEvent.user_id == user_id)
+    if since:
+        query = query.where(AuditEvent.created_at >= since)
+    if until:
+        query = query.where(AuditEvent.created_at < until)
+    query = query.order_by(AuditEvent.id).execution_options(yield_per=batch_size)
+    for row in db.execute(query):
+        yield row._asdict()
+
+
+def _log_file_groups(path: str) -> list:
+    """Log files per process, each oldest first (name.N ... name.1, name)"""
+    stem, suffix = _split_log_path(path)
+    pattern = f"{glob.escape(stem)}-*{glob.escape(suffix)}"
+    # The unsuffixed path holds logs written before per-process files
+    bases = set(glob.glob(pattern)) | {path}
+    groups: dict = {}
+    for name in glob.glob(f"{pattern}.*") + glob.glob(f"{glob.escape(path)}.*"):
+        base, _, index = name.rpartition(".")
+        if index.isdigit():
+            groups.setdefault(base, {})[int(index)] = name
+    for base in bases:
+        if os.path.exists(base):
+            groups.setdefault(base, {})[0] = base
+    return [
+        [files[index] for index in sorted(files, reverse=True)]
+        for _, files in sorted(groups.items())
+    ]
+
+
+def _read_log_group(names: list) -> Iterator[dict]:
+    for name in names:
+        with gzip.open(name, "rt", encoding="utf-8") as f:
+            for line in f:
+                event = json.loads(line)
+                event["created_at"] = datetime.fromisoformat(event["created_at"])
+                yield event
+
+
+def read_log_files(
+    path: str = AUDIT_LOG_PATH,
+    event_type: Optional[str] = None,
+    outcome: Optional[str] = None,
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Iterator[dict]:
+    """Stream events (oldest first) from every process's rotated log files"""
+    streams = [_read_log_group(names) for names in _log_file_groups(path)]
+    for event in heapq.merge(*streams, key=lambda event: event["created_at"]):
+        if event_type and event["event_type"] != event_type:
+            continue
+        if outcome and event["outcome"] != outcome:
+            continue
+        if user_id is not None and event["user_id"] != user_id:
+            continue
+        if since and event["created_at"] < since:
+            continue
+        if until and event["created_at"] >= until:
+            continue
+        yield event
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return value
+
+
+def format_events(events: Iterable[dict], fmt: str) -> Iterator[str]:
+    """Render events as NDJSON lines or CSV rows"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        for event in events:
+            writer.writerow([_csv_value(event[name]) for name in FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+    for event in events:
+        yield json.dumps({**event, "created_at": event["created_at"].isoformat()}) + "\n"
@@ -1,16 +1,19 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
+from pydantic import ValidationError
 import bcrypt
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import and_, select
 from sqlalchemy.orm import Session
 import os
 from dotenv import load_dotenv
 
-from app.database import get_db
-from app.models import User, UserRole
-from app.schemas import TokenData
+from app.database import get_db, get_read_db
+from app.models import User, UserRole, Subscription, SubscriptionStatus
+from app.schemas import TokenData, Principal
+from app.token_versions import token_versions
 
 load_dotenv()
 
@@ -58,6 +61,29 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def create_user_access_token(
+    user: User, expires_delta: Optional[timedelta] = None, db: Optional[Session] = None
+):
+    """
+    Create an access token carrying the user's id, role and token version.
+
+    Pass `db` to read the version from the database: this worker's map may not
+    have seen a revocation made elsewhere yet, and a token issued with an old
+    version would be rejected as soon as it catches up.
+    """
+    if db is not None:
+        token_versions.load(db, [user.id])
+    return create_access_token(
+        data={
+            "sub": user.email,
+            "uid": user.id,
+            "role": user.role.value,
+            "ver": token_versions.current_version(user.id),
+        },
+        expires_delta=expires_delta
+    )
+
+
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
     """Get user by email"""
     return db.query(User).filter(User.email == email).first()
@@ -86,43 +112,130 @@ async def get_token_from_cookie_or_header(
     return token
 
 
-async def get_current_user(
-    request: Request,
-    token: Optional[str] = Depends(get_token_from_cookie_or_header),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get current authenticated user from JWT token (cookie or header)"""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _principal_from_token(token: Optional[str]) -> Principal:
+    """Resolve the caller from a JWT and the token version map, or raise 401"""
+    credentials_exception = _credentials_exception()
     
     if not token:
         raise credentials_exception
         
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
-    except JWTError:
+        token_data = TokenData(
+            email=payload.get("sub"),
+            user_id=payload.get("uid"),
+            role=payload.get("role"),
+            version=payload.get("ver", 0),
+        )
+    except (JWTError, ValidationError):
         raise credentials_exception
-    user = get_user_by_email(db, email=token_data.email)
-    if user is None:
+    if token_data.email is None or token_data.user_id is None or token_data.role is None:
         raise credentials_exception
+
+    role = token_data.role
+    entry = token_versions.get(token_data.user_id)
+    if entry:
+        if token_data.version < entry.revoked_below:
+            raise credentials_exception
+        # Role changed since the token was issued
+        if token_data.version < entry.version:
+            role = entry.role
+    return Principal(
+        id=token_data.user_id,
+        email=token_data.email,
+        role=role,
+        token_version=token_data.version,
+    )
+
+
+def _user_from_token(db: Session, token: Optional[str]) -> User:
+    """Load the user a JWT belongs to, or raise 401"""
+    user = db.get(User, _principal_from_token(token).id)
+    if user is None:
+        raise _credentials_exception()
     return user
 
 
+async def get_current_principal(
+    token: Optional[str] = Depends(get_token_from_cookie_or_header)
+) -> Principal:
+    """Get the current caller's id, email and role without touching the database"""
+    return _principal_from_token(token)
+
+
+async def get_current_user(
+    request: Request,
+    token: Optional[str] = Depends(get_token_from_cookie_or_header),
+    db: Session = Depends(get_db)
+) -> User:
+    """Get current authenticated user from JWT token (cookie or header)"""
+    return _user_from_token(db, token)
+
+
+async def get_current_user_read(
+    request: Request,
+    token: Optional[str] = Depends(get_token_from_cookie_or_header),
+    db: Session = Depends(get_read_db)
+) -> User:
+    """Get current user through the read session, for routes that only read"""
+    return _user_from_token(db, token)
+
+
+def current_user_with_subscription(active_only: bool = False):
+    """
+    Dependency that loads the current user and their latest subscription
+    (or latest active one) in a single query, as (user, subscription).
+    """
+    async def loader(
+        token: Optional[str] = Depends(get_token_from_cookie_or_header),
+        db: Session = Depends(get_read_db)
+    ) -> tuple:
+        principal = _principal_from_token(token)
+        join_on = Subscription.user_id == User.id
+        if active_only:
+            join_on = and_(join_on, Subscription.status == SubscriptionStatus.ACTIVE)
+        row = db.execute(
+            select(User, Subscription)
+            .outerjoin(Subscription, join_on)
+            .where(User.id == principal.id)
+            .order_by(Subscription.created_at.desc(), Subscription.id.desc())
+            .limit(1)
+        ).first()
+        if row is None:
+            raise _credentials_exception()
+        return row.User, row.Subscription
+    return loader
+
+
+# Shared instances so FastAPI caches the result per request
+get_current_user_with_subscription = current_user_with_subscription()
+get_current_user_with_active_subscription = current_user_with_subscription(active_only=True)
+
+
+def has_premium_access(user: User, subscription: Optional[Subscription]) -> bool:
+    """Whether the user may use premium features"""
+    return (
+        user.role in [UserRole.PREMIUM, UserRole.ADMIN] or
+        (subscription is not None and subscription.status == SubscriptionStatus.ACTIVE)
+    )
+
+
 def require_role(allowed_roles: list[UserRole]):
     """Dependency to require specific user roles"""
-    async def role_checker(current_user: User = Depends(get_current_user)):
-        if current_user.role not in allowed_roles:
+    async def role_checker(principal: Principal = Depends(get_current_principal)):
+        if principal.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Insufficient permissions"
             )
-        return current_user
+        return principal
     return role_checker
 
@@ -1,31 +1,206 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import itertools
+import logging
+import threading
+import time
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./saas_app.db")
+# Comma-separated read replicas; reads go to the primary when unset
+REPLICA_DATABASE_URLS = [
+    url.strip() for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if url.strip()
+]
+MAX_REPLICA_LAG_SECONDS = float(os.getenv("MAX_REPLICA_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "2"))
+STICKY_PRIMARY_SECONDS = int(os.getenv("STICKY_PRIMARY_SECONDS", "10"))
+STICKY_PRIMARY_COOKIE = "read_primary_until"
+# Adds an X-DB-Query-Count header to every response (debugging only)
+DEBUG_QUERY_COUNT = os.getenv("DEBUG_QUERY_COUNT", "false").lower() == "true"
+
+
+def _create_engine(url: str):
+    # For SQLite, we need to handle thread safety
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(url)
 
-# For SQLite, we need to handle thread safety
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL, connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(DATABASE_URL)
+
+engine = _create_engine(DATABASE_URL)
+replica_engines = [_create_engine(url) for url in REPLICA_DATABASE_URLS]
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Bound per session to whichever engine get_read_db picks
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
 
-def get_db():
+def ensure_indexes():
+    """
+    Create model indexes missing from existing tables.
+
+    create_all only creates tables that don't exist yet, so indexes added to
+    models later (e.g. subscriptions.user_id, ix_subscriptions_expiring)
+    would otherwise never reach an existing database.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except DBAPIError:
+                # Usually another worker starting at the same time created it
+                logger.warning("Could not create index %s", index.name, exc_info=True)
+
+
+class ReplicaPool:
+    """Round-robin over replicas, skipping any that lag too far behind"""
+
+    def __init__(self, engines: list):
+        self.engines = engines
+        self._counter = itertools.count()
+        self._lag: dict = {}
+        self._lock = threading.Lock()
+
+    def replication_lag(self, replica) -> Optional[float]:
+        """Seconds the replica is behind (cached); None if it is unreachable"""
+        now = time.monotonic()
+        checked_at, lag = self._lag.get(replica, (None, None))
+        if checked_at is not None and now - checked_at < REPLICA_LAG_CHECK_SECONDS:
+            return lag
+        with self._lock:
+            checked_at, lag = self._lag.get(replica, (None, None))
+            if checked_at is not None and now - checked_at < REPLICA_LAG_CHECK_SECONDS:
+                return lag
+            lag = _measure_lag(replica)
+            self._lag[replica] = (now, lag)
+            return lag
+
+    def choose(self):
+        """Pick a healthy replica, or None if reads should use the primary"""
+        for _ in range(len(self.engines)):
+            replica = self.engines[next(self._counter) % len(self.engines)]
+            lag = self.replication_lag(replica)
+            if lag is not None and lag <= MAX_REPLICA_LAG_SECONDS:
+                return replica
+        return None
+
+
+def _measure_lag(replica) -> Optional[float]:
+    try:
+        with replica.connect() as conn:
+            if replica.dialect.name != "postgresql":
+                # No replication to measure (e.g. local SQLite stand-ins)
+                conn.execute(text("SELECT 1"))
+                return 0.0
+            lag = conn.execute(text(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )).scalar()
+            return float(lag or 0)
+    except Exception:
+        logger.warning("Replica %s is unavailable", replica.url, exc_info=True)
+        return None
+
+
+replicas = ReplicaPool(replica_engines)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_write(session):
+    """Remember that the current request wrote, for read-your-writes"""
+    request = session.info.get("request")
+    if request is not None:
+        request.state.db_wrote = True
+
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _reject_writes(session, flush_context, instances):
+    raise RuntimeError("Read-only session: use get_db for writes")
+
+
+class QueryCounter:
+    """Number of SQL statements executed while the counter is active"""
+
+    def __init__(self):
+        self.count = 0
+
+
+_query_counter: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+
+@contextmanager
+def count_queries():
+    """Count queries run in this context (including threadpool work it starts)"""
+    counter = QueryCounter()
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Test helper: fail if the block runs more than `limit` queries"""
+    with count_queries() as counter:
+        yield counter
+    assert counter.count <= limit, f"Expected at most {limit} queries, ran {counter.count}"
+
+
+def mark_primary_sticky(response):
+    """Route this client's reads to the primary for a while after a write"""
+    if replica_engines:
+        response.set_cookie(
+            key=STICKY_PRIMARY_COOKIE,
+            value=str(int(time.time()) + STICKY_PRIMARY_SECONDS),
+            httponly=True,
+            max_age=STICKY_PRIMARY_SECONDS,
+            samesite="lax"
+        )
+
+
+def _is_sticky(request: Request) -> bool:
+    until = request.cookies.get(STICKY_PRIMARY_COOKIE, "")
+    return until.isdigit() and int(until) > time.time()
+
+
+def get_db(request: Request):
     """Dependency for getting database session"""
     db = SessionLocal()
+    db.info["request"] = request
     try:
         yield db
     finally:
         db.close()
 
+
+def get_read_db(request: Request):
+    """Dependency for getting a read-only session, on a replica when possible"""
+    bind = None
+    if replica_engines and not _is_sticky(request):
+        bind = replicas.choose()
+    db = ReadSessionLocal(bind=bind or engine)
+    try:
+        yield db
+    finally:
+        db.close()
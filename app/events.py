@@ -0,0 +1,134 @@
+"""
+In-process pub/sub for pushing account changes to connected browsers.
+
+Each open server-sent events stream registers a small subscriber object for
+its user. Role changes are published from the token version map (see
+app/token_versions.py), which already sees every change: immediately for
+writes committed by this worker, and on the next poll for changes made by
+other workers, the expiry sweeper or reconciliation.
+
+Subscribers only keep the latest event rather than a queue: a role event
+describes the current state, so an older undelivered one is never useful.
+That keeps an idle connection down to one future and one slot.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from typing import AsyncIterator, Callable, Optional
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Ask browsers to wait this long before reconnecting a dropped stream
+SSE_RETRY_MILLISECONDS = 3000
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Subscriber:
+    """One open event stream"""
+
+    __slots__ = ("loop", "waiter", "pending")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.waiter: Optional[asyncio.Future] = None
+        self.pending: Optional[dict] = None
+
+    def _deliver(self, event: dict):
+        self.pending = event
+        if self.waiter is not None:
+            _wake(self.waiter)
+
+    async def next_event(self, timeout: float) -> Optional[dict]:
+        """Latest undelivered event, or None if nothing arrived within timeout"""
+        if self.pending is None:
+            waiter = self.waiter = self.loop.create_future()
+            timer = self.loop.call_later(timeout, _wake, waiter)
+            try:
+                await waiter
+            finally:
+                timer.cancel()
+                self.waiter = None
+        event, self.pending = self.pending, None
+        return event
+
+
+class EventBus:
+    """Subscribers per user id; publish() may be called from any thread"""
+
+    def __init__(self):
+        self._subscribers: dict = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id: int, subscriber: Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[user_id]
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, user_id: int, event: dict):
+        """Send an event to every open stream of a user (no-op if none)"""
+        # Unlocked fast path: most role changes have nobody listening
+        if user_id not in self._subscribers:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for subscriber in subscribers:
+            if running is subscriber.loop:
+                subscriber._deliver(event)
+            elif not subscriber.loop.is_closed():
+                subscriber.loop.call_soon_threadsafe(subscriber._deliver, event)
+
+
+event_bus = EventBus()
+
+
+def format_event(name: str, data: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(
+    user_id: int, initial: Optional[Callable[[], dict]] = None
+) -> AsyncIterator[str]:
+    """
+    Server-sent events for one user until the client disconnects.
+
+    `initial` builds the first event (the current state); it is called after
+    subscribing so a change landing in between is not lost.
+    """
+    subscriber = event_bus.subscribe(user_id)
+    try:
+        yield f"retry: {SSE_RETRY_MILLISECONDS}\n\n"
+        if initial is not None:
+            event = initial()
+            yield format_event(event["type"], event)
+        while True:
+            event = await subscriber.next_event(SSE_HEARTBEAT_SECONDS)
+            if event is None:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            else:
+                yield format_event(event["type"], event)
+    finally:
+        event_bus.unsubscribe(user_id, subscriber)
@@ -0,0 +1,247 @@
+"""
+Bulk user import from CSV or NDJSON.
+
+Rows need an `email` and either a plain `password` (hashed across a process
+pool) or an existing bcrypt `password_hash`; an optional `role` defaults to
+free. Emails are de-duplicated in memory and against the database, and users
+are inserted in large executemany batches, one transaction per batch.
+
+import_users.py is the bulk path. The admin API queues uploads as background
+jobs (one at a time per worker) tracked in `import_jobs`.
+"""
+
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional, TextIO
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from app.auth import get_password_hash
+from app.database import SessionLocal
+from app.models import ImportJob, User, UserRole
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+_email_adapter = TypeAdapter(EmailStr)
+
+# Stands in for an NDJSON line that could not be parsed, so it is reported
+# under its own row number
+INVALID_JSON = object()
+
+# Hashing processes must not be forked from the (multi-threaded) web server
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Admin API imports run here, one at a time, off the request path
+_job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-import")
+
+
+@dataclass
+class ImportReport:
+    """Outcome of a bulk import"""
+    read: int = 0
+    inserted: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    seconds: float = 0.0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return round(self.read / self.seconds, 1) if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "seconds": round(self.seconds, 2),
+            "rows_per_second": self.rows_per_second,
+            "errors": self.errors,
+        }
+
+    def reject(self, row: int, reason: str):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": reason})
+
+
+def read_rows(stream: TextIO, fmt: str) -> Iterator[dict]:
+    """Yield rows from a CSV (with header) or NDJSON text stream"""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield INVALID_JSON
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def _is_bcrypt_hash(value: str) -> bool:
+    return len(value) == 60 and value.startswith(BCRYPT_PREFIXES)
+
+
+def _prepare(batch: list, first_row: int, seen: set, report: ImportReport) -> tuple:
+    """Validate and de-duplicate a batch; returns (rows, plain passwords to hash)"""
+    rows = []
+    to_hash = []
+    for offset, raw in enumerate(batch):
+        row_number = first_row + offset
+        if raw is INVALID_JSON:
+            report.reject(row_number, "Invalid JSON")
+            continue
+        if not isinstance(raw, dict):
+            report.reject(row_number, "Not a JSON object")
+            continue
+        fields = ("email", "password", "password_hash", "role")
+        if any(not isinstance(raw.get(name) or "", str) for name in fields):
+            report.reject(row_number, "email, password, password_hash and role must be strings")
+            continue
+        email = (raw.get("email") or "").strip()
+        password = raw.get("password") or ""
+        password_hash = (raw.get("password_hash") or "").strip()
+        try:
+            _email_adapter.validate_python(email)
+        except ValidationError:
+            report.reject(row_number, "Invalid email")
+            continue
+        try:
+            role = UserRole(raw.get("role") or UserRole.FREE)
+        except ValueError:
+            report.reject(row_number, "Invalid role")
+            continue
+        if password_hash and not _is_bcrypt_hash(password_hash):
+            report.reject(row_number, "password_hash is not a bcrypt hash")
+            continue
+        if not password_hash and not password:
+            report.reject(row_number, "Missing password")
+            continue
+        if email in seen:
+            report.duplicates += 1
+            continue
+        seen.add(email)
+
+        row = {"email": email, "password_hash": password_hash or None, "role": role}
+        if not password_hash:
+            to_hash.append((len(rows), password))
+        rows.append(row)
+    return rows, to_hash
+
+
+def _insert_batch(db: Session, rows: list, report: ImportReport):
+    """Insert rows whose email is not already registered, in one transaction"""
+    emails = [row["email"] for row in rows]
+    existing = set(db.execute(select(User.email).where(User.email.in_(emails))).scalars())
+    new_rows = [row for row in rows if row["email"] not in existing]
+    report.duplicates += len(rows) - len(new_rows)
+    if new_rows:
+        db.execute(insert(User), new_rows)
+    db.commit()
+    report.inserted += len(new_rows)
+
+
+def import_users(
+    db: Session,
+    rows: Iterable[dict],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: Optional[int] = None,
+    on_batch: Optional[Callable[[ImportReport], None]] = None,
+) -> ImportReport:
+    """Import users from an iterable of row dicts; on_batch is called after each batch"""
+    report = ImportReport()
+    seen: set = set()
+    started = time.monotonic()
+    iterator = iter(rows)
+    row_number = 1
+    workers = workers or os.cpu_count() or 1
+
+    context = multiprocessing.get_context(_START_METHOD)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+            report.read += len(batch)
+            prepared, to_hash = _prepare(batch, row_number, seen, report)
+            row_number += len(batch)
+
+            if to_hash:
+                chunksize = max(1, len(to_hash) // (workers * 4))
+                hashes = pool.map(
+                    get_password_hash,
+                    [password for _, password in to_hash],
+                    chunksize=chunksize,
+                )
+                for (index, _), hashed in zip(to_hash, hashes):
+                    prepared[index]["password_hash"] = hashed
+
+            if prepared:
+                _insert_batch(db, prepared, report)
+            if on_batch:
+                report.seconds = time.monotonic() - started
+                on_batch(report)
+
+    report.seconds = time.monotonic() - started
+    return report
+
+
+def _update_job(db: Session, job_id: str, **values):
+    db.execute(update(ImportJob).where(ImportJob.id == job_id).values(**values))
+    db.commit()
+
+
+def _run_import_job(job_id: str, path: str, fmt: str):
+    db = SessionLocal()
+    try:
+        _update_job(db, job_id, status="running")
+        with open(path, "r", newline="", encoding="utf-8") as stream:
+            report = import_users(
+                db,
+                read_rows(stream, fmt),
+                on_batch=lambda progress: _update_job(db, job_id, report=progress.as_dict()),
+            )
+        _update_job(
+            db, job_id, status="completed", report=report.as_dict(), finished_at=datetime.utcnow()
+        )
+    except Exception as exc:
+        logger.exception("User import %s failed", job_id)
+        db.rollback()
+        _update_job(db, job_id, status="failed", error=str(exc), finished_at=datetime.utcnow())
+    finally:
+        db.close()
+        os.remove(path)
+
+
+def start_import_job(db: Session, path: str, fmt: str, filename: Optional[str] = None) -> ImportJob:
+    """
+    Queue an import of the file at `path` (removed once the job ends).
+
+    Jobs run in this worker's background thread; their status and report are
+    stored in `import_jobs`, so any worker can answer status requests.
+    """
+    job = ImportJob(
+        id=uuid.uuid4().hex, status="queued", filename=filename, created_at=datetime.utcnow()
+    )
+    db.add(job)
+    db.commit()
+    _job_executor.submit(_run_import_job, job.id, path, fmt)
+    return job
@@ -3,16 +3,19 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import os
 from dotenv import load_dotenv
 
-from app.database import engine, Base
-from app.routers import auth, billing, dashboard, premium
+from app.database import engine, Base, SessionLocal, DEBUG_QUERY_COUNT, count_queries, ensure_indexes, mark_primary_sticky
+from app.routers import auth, billing, dashboard, premium, admin
+from app import sweeper, usage, quotas, token_versions, audit
 
 load_dotenv()
 
-# Create database tables
+# Create database tables, and indexes added to existing ones
 Base.metadata.create_all(bind=engine)
+ensure_indexes()
 
 app = FastAPI(
     title="SaaS Auth & Subscription App",
@@ -29,6 +32,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Keep a client's reads on the primary briefly after it writes"""
+    response = await call_next(request)
+    if getattr(request.state, "db_wrote", False):
+        mark_primary_sticky(response)
+    return response
+
+
+if DEBUG_QUERY_COUNT:
+    @app.middleware("http")
+    async def query_count_header(request: Request, call_next):
+        """Report how many SQL queries each request ran"""
+        with count_queries() as counter:
+            response = await call_next(request)
+        response.headers["X-DB-Query-Count"] = str(counter.count)
+        return response
+
+
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -38,6 +61,38 @@ app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(billing.router, prefix="/billing", tags=["Billing"])
 app.include_router(dashboard.router, prefix="/dashboard", tags=["Dashboard"])
 app.include_router(premium.router, prefix="/premium", tags=["Premium"])
+app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    """Load token versions and start background jobs"""
+    token_versions.sync_token_versions()
+    if sweeper.SWEEP_INTERVAL_SECONDS > 0:
+        app.state.sweeper_task = asyncio.create_task(sweeper.sweeper_loop())
+    app.state.usage_task = asyncio.create_task(usage.usage_flush_loop())
+    app.state.quota_task = asyncio.create_task(quotas.quota_sync_loop())
+    app.state.token_version_task = asyncio.create_task(token_versions.token_version_sync_loop())
+    app.state.audit_task = asyncio.create_task(audit.audit_flush_loop())
+
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    """Stop background jobs, flush pending usage/audit events and release the sweeper lease"""
+    app.state.usage_task.cancel()
+    app.state.quota_task.cancel()
+    app.state.token_version_task.cancel()
+    app.state.audit_task.cancel()
+    usage.flush_usage()
+    audit.flush_audit()
+    task = getattr(app.state, "sweeper_task", None)
+    if task:
+        task.cancel()
+        db = SessionLocal()
+        try:
+            sweeper.release_lease(db, sweeper.LEASE_NAME, sweeper.HOLDER_ID)
+        finally:
+            db.close()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index, UniqueConstraint, JSON, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -36,9 +36,14 @@ class User(Base):
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    # Expiry sweeper: equality on status and cancel_at_period_end, then a
+    # range on current_period_end
+    __table_args__ = (
+        Index("ix_subscriptions_expiring", "status", "cancel_at_period_end", "current_period_end"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     stripe_subscription_id = Column(String, unique=True, nullable=True)
     status = Column(SQLEnum(SubscriptionStatus), default=SubscriptionStatus.INCOMPLETE)
     plan_name = Column(String, nullable=True)  # monthly, annual
@@ -49,3 +54,76 @@ class Subscription(Base):
 
     user = relationship("User", back_populates="subscriptions")
 
+
+class JobLease(Base):
+    """Time-limited lock so only one worker runs a periodic job at a time"""
+    __tablename__ = "job_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class UsageRecord(Base):
+    """Premium API calls per user per minute (minute = Unix time // 60)"""
+    __tablename__ = "usage_records"
+    __table_args__ = (UniqueConstraint("user_id", "minute", name="uq_usage_user_minute"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    minute = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class UsageTotal(Base):
+    """Premium API calls per user per period, added to by the same flush as usage_records"""
+    __tablename__ = "usage_totals"
+    __table_args__ = (
+        UniqueConstraint("user_id", "period", "period_start", name="uq_usage_total_user_period"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    period = Column(String, nullable=False)  # hour, day or month (UTC calendar month)
+    period_start = Column(Integer, nullable=False)  # first minute, as in usage_records
+    count = Column(Integer, nullable=False, default=0)
+
+
+class TokenVersion(Base):
+    """Latest token version and role for users whose role changed since signup"""
+    __tablename__ = "token_versions"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    role = Column(SQLEnum(UserRole), nullable=False)
+    # Tokens with a lower version are rejected outright
+    revoked_below = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, index=True)
+
+
+class ImportJob(Base):
+    """Bulk user import started from the admin API and run in the background"""
+    __tablename__ = "import_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    status = Column(String, nullable=False)  # queued, running, completed, failed
+    filename = Column(String, nullable=True)
+    report = Column(JSON, nullable=True)  # ImportReport.as_dict(), updated per batch
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class AuditEvent(Base):
+    """Logins, registrations, role changes and webhook outcomes"""
+    __tablename__ = "audit_events"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    event_type = Column(String, nullable=False, index=True)  # login, register, role_change, ...
+    outcome = Column(String, nullable=False)  # success, failure, processed, ignored, error
+    # No foreign key: the trail has to outlive deleted users
+    user_id = Column(Integer, nullable=True, index=True)
+    email = Column(String, nullable=True)
+    ip_address = Column(String, nullable=True)
+    details = Column(JSON, nullable=True)
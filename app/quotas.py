@@ -0,0 +1,206 @@
+"""
+Plan-based quotas and burst limits for the premium API.
+
+Each plan gets a monthly call quota (UTC calendar month, shared across workers)
+and a per-minute burst limit (per worker, to stop one customer saturating it).
+Checks only touch in-memory dicts; the plan comes from the subscription the
+route loads anyway. Every QUOTA_SYNC_SECONDS each worker flushes
+its metered usage and reloads per-user monthly totals from `usage_totals`
+(one row per user, maintained by the flush), which is how workers see each
+other's traffic.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Response
+from sqlalchemy import select
+
+from app.auth import get_current_user_with_active_subscription, has_premium_access
+from app.database import SessionLocal
+from app.models import UserRole, UsageTotal
+from app.usage import flush_usage
+
+logger = logging.getLogger(__name__)
+
+QUOTA_SYNC_SECONDS = int(os.getenv("QUOTA_SYNC_SECONDS", "5"))
+_LOAD_CHUNK_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class PlanQuota:
+    monthly_calls: int
+    burst_per_minute: int
+
+
+PLAN_QUOTAS = {
+    "monthly": PlanQuota(monthly_calls=10_000, burst_per_minute=60),
+    "annual": PlanQuota(monthly_calls=50_000, burst_per_minute=120),
+}
+# Premium users without a plan on record (e.g. granted manually)
+DEFAULT_PLAN = "monthly"
+
+
+def quota_for_plan(plan_name: Optional[str]) -> PlanQuota:
+    return PLAN_QUOTAS.get(plan_name or DEFAULT_PLAN, PLAN_QUOTAS[DEFAULT_PLAN])
+
+
+def _month_bounds(now: float) -> tuple:
+    """(start, end) of the UTC calendar month containing `now`, as Unix times"""
+    current = datetime.fromtimestamp(now, tz=timezone.utc)
+    start = current.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start.timestamp(), end.timestamp()
+
+
+class QuotaTracker:
+    """In-memory quota and burst counters for one worker"""
+
+    def __init__(self):
+        self._period_start, self._period_end = _month_bounds(time.time())
+        # Monthly calls recorded in the shared store as of the last sync
+        self._baseline: dict = {}
+        # Calls admitted by this worker since the last sync
+        self._local: dict = {}
+        # user_id -> [minute, calls in that minute]
+        self._burst: dict = {}
+
+    def consume(self, user_id: int, quota: PlanQuota, now: float) -> tuple:
+        """
+        Admit one call if both limits allow it.
+
+        Returns (allowed, limit, remaining, reset) for whichever limit is
+        closer to running out; reset is a Unix time.
+        """
+        if now >= self._period_end:
+            self._rollover(now)
+
+        minute = int(now // 60)
+        burst = self._burst.get(user_id)
+        if burst is None or burst[0] != minute:
+            burst = self._burst[user_id] = [minute, 0]
+        burst_reset = (minute + 1) * 60
+
+        burst_remaining = quota.burst_per_minute - burst[1]
+        if burst_remaining <= 0:
+            return False, quota.burst_per_minute, 0, burst_reset
+        local = self._local.get(user_id, 0)
+        monthly_remaining = quota.monthly_calls - self._baseline.get(user_id, 0) - local
+        if monthly_remaining <= 0:
+            return False, quota.monthly_calls, 0, int(self._period_end)
+
+        burst[1] += 1
+        self._local[user_id] = local + 1
+        if burst_remaining < monthly_remaining:
+            return True, quota.burst_per_minute, burst_remaining - 1, burst_reset
+        return True, quota.monthly_calls, monthly_remaining - 1, int(self._period_end)
+
+    def _rollover(self, now: float):
+        self._period_start, self._period_end = _month_bounds(now)
+        self._baseline.clear()
+        self._local.clear()
+
+    def snapshot(self) -> dict:
+        """Local counts to be folded into the shared totals by the next sync"""
+        return dict(self._local)
+
+    def tracked_users(self) -> set:
+        return set(self._local) | set(self._baseline)
+
+    def apply_sync(self, totals: dict, snapshot: dict, period_start: float):
+        """Replace baselines with shared totals and drop the counts they include"""
+        if period_start != self._period_start:
+            return
+        self._baseline = totals
+        for user_id, count in snapshot.items():
+            remaining = self._local.get(user_id, 0) - count
+            if remaining > 0:
+                self._local[user_id] = remaining
+            else:
+                self._local.pop(user_id, None)
+        # Drop finished burst windows
+        minute = int(time.time() // 60)
+        self._burst = {u: b for u, b in self._burst.items() if b[0] == minute}
+
+    @property
+    def period_start(self) -> float:
+        return self._period_start
+
+
+quota_tracker = QuotaTracker()
+
+
+def _load_monthly_totals(user_ids: list, period_start: float) -> dict:
+    """Flush pending usage, then read each user's calls this month"""
+    flush_usage()
+    if not user_ids:
+        return {}
+    first_minute = int(period_start // 60)
+    totals = {}
+    db = SessionLocal()
+    try:
+        for start in range(0, len(user_ids), _LOAD_CHUNK_SIZE):
+            chunk = user_ids[start:start + _LOAD_CHUNK_SIZE]
+            rows = db.execute(
+                select(UsageTotal.user_id, UsageTotal.count).where(
+                    UsageTotal.user_id.in_(chunk),
+                    UsageTotal.period == "month",
+                    UsageTotal.period_start == first_minute,
+                )
+            )
+            totals.update({user_id: int(count) for user_id, count in rows})
+    finally:
+        db.close()
+    return totals
+
+
+async def quota_sync_loop():
+    """Sync quota counters with the shared usage table until cancelled"""
+    while True:
+        await asyncio.sleep(QUOTA_SYNC_SECONDS)
+        # Taken on the event loop, so no call is admitted mid-snapshot; calls
+        # admitted while the flush runs may be counted twice until next sync
+        snapshot = quota_tracker.snapshot()
+        period_start = quota_tracker.period_start
+        try:
+            totals = await asyncio.to_thread(
+                _load_monthly_totals, list(quota_tracker.tracked_users()), period_start
+            )
+        except Exception:
+            logger.exception("Quota sync failed")
+            continue
+        quota_tracker.apply_sync(totals, snapshot, period_start)
+
+
+async def enforce_quota(
+    response: Response,
+    user_and_subscription: tuple = Depends(get_current_user_with_active_subscription)
+):
+    """Dependency that applies the caller's plan quota and burst limit"""
+    current_user, subscription = user_and_subscription
+    # Reject before counting, so a refused call never uses up a quota
+    if not has_premium_access(current_user, subscription):
+        raise HTTPException(status_code=403, detail="Premium subscription required")
+    if current_user.role == UserRole.ADMIN:
+        return
+
+    quota = quota_for_plan(subscription.plan_name if subscription else None)
+    now = time.time()
+    allowed, limit, remaining, reset = quota_tracker.consume(current_user.id, quota, now)
+    headers = {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset),
+    }
+    if not allowed:
+        headers["Retry-After"] = str(max(1, int(reset - now)))
+        raise HTTPException(status_code=429, detail="Rate limit exceeded", headers=headers)
+    response.headers.update(headers)
@@ -0,0 +1,397 @@
+"""
+Reconcile local subscriptions and user roles against Stripe.
+
+Stripe is treated as the source of truth. Subscriptions are streamed with
+auto-pagination (one stream per Stripe status, fetched concurrently), compared
+against the database in fixed-size chunks and written back with bulk
+inserts/updates, so memory stays bounded regardless of account size.
+"""
+
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional, TextIO
+
+import stripe
+from sqlalchemy import exists, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models import User, UserRole, Subscription, SubscriptionStatus
+from app.token_versions import record_role_changes
+
+# Every status Stripe can report; listed separately so each stream can be
+# fetched (and checkpointed) independently
+STRIPE_STATUSES = [
+    "active",
+    "trialing",
+    "past_due",
+    "unpaid",
+    "canceled",
+    "incomplete",
+    "incomplete_expired",
+    "paused",
+]
+
+# Stripe statuses without a local equivalent
+STATUS_FALLBACKS = {
+    "unpaid": SubscriptionStatus.PAST_DUE,
+    "incomplete_expired": SubscriptionStatus.CANCELED,
+    "paused": SubscriptionStatus.PAST_DUE,
+}
+
+PLAN_INTERVALS = {"month": "monthly", "year": "annual"}
+
+STRIPE_PAGE_SIZE = 100
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CONCURRENCY = 4
+
+_DONE = object()
+
+
+@dataclass
+class ReconcileReport:
+    """Summary of a reconciliation run"""
+    scanned: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    orphaned: int = 0
+    upgraded: int = 0
+    downgraded: int = 0
+    dry_run: bool = False
+    diff_file: Optional[TextIO] = None
+
+    def record(self, change: dict):
+        """Append one change to the diff report (NDJSON), if one was requested"""
+        if self.diff_file is not None:
+            self.diff_file.write(json.dumps(change) + "\n")
+
+    def as_dict(self) -> dict:
+        return {
+            "scanned": self.scanned,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "orphaned": self.orphaned,
+            "upgraded": self.upgraded,
+            "downgraded": self.downgraded,
+            "dry_run": self.dry_run,
+        }
+
+
+class Checkpoint:
+    """Last reconciled subscription id per Stripe status, persisted as JSON"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.cursors: dict = {}
+        self.completed: set = set()
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.cursors = data.get("cursors", {})
+            self.completed = set(data.get("completed", []))
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"cursors": self.cursors, "completed": sorted(self.completed)}, f
+            )
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def map_status(stripe_status: str) -> SubscriptionStatus:
+    """Map a Stripe subscription status onto SubscriptionStatus"""
+    if stripe_status in STATUS_FALLBACKS:
+        return STATUS_FALLBACKS[stripe_status]
+    return SubscriptionStatus(stripe_status)
+
+
+def plan_name_for(stripe_subscription) -> Optional[str]:
+    """Derive the local plan name (monthly, annual) from a Stripe subscription"""
+    metadata = stripe_subscription.get("metadata") or {}
+    if metadata.get("plan"):
+        return metadata["plan"]
+    items = (stripe_subscription.get("items") or {}).get("data") or []
+    if not items:
+        return None
+    recurring = (items[0].get("price") or {}).get("recurring") or {}
+    return PLAN_INTERVALS.get(recurring.get("interval"))
+
+
+def desired_state(stripe_subscription) -> dict:
+    """Column values a local row should have for this Stripe subscription"""
+    period_end = stripe_subscription.get("current_period_end")
+    return {
+        "status": map_status(stripe_subscription["status"]),
+        "plan_name": plan_name_for(stripe_subscription),
+        "current_period_end": datetime.fromtimestamp(period_end) if period_end else None,
+        "cancel_at_period_end": bool(stripe_subscription.get("cancel_at_period_end")),
+    }
+
+
+def _stream_status(status: str, starting_after: Optional[str]) -> Iterator:
+    """Auto-paginate over all Stripe subscriptions with the given status"""
+    params = {"status": status, "limit": STRIPE_PAGE_SIZE}
+    if starting_after:
+        params["starting_after"] = starting_after
+    return stripe.Subscription.list(**params).auto_paging_iter()
+
+
+def stream_subscriptions(
+    checkpoint: Checkpoint,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    buffer_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple]:
+    """
+    Yield (status, stripe_subscription) pairs from all Stripe status streams.
+
+    At most `concurrency` streams are fetched at once and the shared buffer is
+    bounded, so fetchers block instead of outrunning the database writer.
+    """
+    statuses = [s for s in STRIPE_STATUSES if s not in checkpoint.completed]
+    buffer: queue.Queue = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(status: str):
+        try:
+            for item in _stream_status(status, checkpoint.cursors.get(status)):
+                if not put((status, item)):
+                    return
+        except Exception as exc:
+            put((status, exc))
+            return
+        put((status, _DONE))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        for status in statuses:
+            executor.submit(fetch, status)
+        remaining = len(statuses)
+        while remaining:
+            status, item = buffer.get()
+            if item is _DONE:
+                remaining -= 1
+                yield status, _DONE
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield status, item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _apply_chunk(db: Session, chunk: list, report: ReconcileReport):
+    """Diff one chunk of Stripe subscriptions against the database and write it"""
+    # A subscription whose status changed mid-run can arrive from two status
+    # streams; keep the copy seen last so it is written once
+    chunk = list({item["id"]: item for item in chunk}.values())
+    subscription_ids = [item["id"] for item in chunk]
+    customer_ids = {item["customer"] for item in chunk if item.get("customer")}
+
+    existing = {
+        row.stripe_subscription_id: row
+        for row in db.execute(
+            select(
+                Subscription.id,
+                Subscription.stripe_subscription_id,
+                Subscription.status,
+                Subscription.plan_name,
+                Subscription.current_period_end,
+                Subscription.cancel_at_period_end,
+            ).where(Subscription.stripe_subscription_id.in_(subscription_ids))
+        )
+    }
+    users_by_customer = dict(
+        db.execute(
+            select(User.stripe_customer_id, User.id).where(
+                User.stripe_customer_id.in_(customer_ids)
+            )
+        ).all()
+    ) if customer_ids else {}
+
+    inserts = []
+    updates = []
+    for item in chunk:
+        desired = desired_state(item)
+        row = existing.get(item["id"])
+        if row is None:
+            user_id = users_by_customer.get(item.get("customer"))
+            if user_id is None:
+                report.orphaned += 1
+                report.record({
+                    "action": "orphan",
+                    "stripe_subscription_id": item["id"],
+                    "customer": item.get("customer"),
+                })
+                continue
+            inserts.append({
+                "user_id": user_id,
+                "stripe_subscription_id": item["id"],
+                **desired,
+            })
+            report.record({
+                "action": "insert",
+                "stripe_subscription_id": item["id"],
+                "user_id": user_id,
+                "status": desired["status"].value,
+            })
+            continue
+
+        current_period_end = row.current_period_end
+        if current_period_end is not None and current_period_end.tzinfo is not None:
+            current_period_end = current_period_end.replace(tzinfo=None)
+        current = {
+            "status": row.status,
+            "plan_name": row.plan_name,
+            "current_period_end": current_period_end,
+            "cancel_at_period_end": bool(row.cancel_at_period_end),
+        }
+        diff = {
+            key: [_jsonable(current[key]), _jsonable(value)]
+            for key, value in desired.items()
+            if current[key] != value
+        }
+        if not diff:
+            report.unchanged += 1
+            continue
+        updates.append({"id": row.id, **desired})
+        report.record({
+            "action": "update",
+            "stripe_subscription_id": item["id"],
+            "changes": diff,
+        })
+
+    if inserts:
+        db.execute(insert(Subscription), inserts)
+    if updates:
+        db.execute(update(Subscription), updates)
+    report.inserted += len(inserts)
+    report.updated += len(updates)
+
+
+def _sync_roles(db: Session, report: ReconcileReport):
+    """Set user roles from the (now reconciled) subscription table in bulk"""
+    has_active = exists().where(
+        Subscription.user_id == User.id,
+        Subscription.status == SubscriptionStatus.ACTIVE,
+    )
+    # Admins are never touched; only Stripe customers are downgraded so
+    # manually granted premium accounts survive
+    transitions = [
+        (User.role == UserRole.FREE, has_active, UserRole.PREMIUM),
+        (User.role == UserRole.PREMIUM, ~has_active & User.stripe_customer_id.isnot(None), UserRole.FREE),
+    ]
+    for role_clause, condition, new_role in transitions:
+        user_ids = db.execute(
+            select(User.id).where(role_clause, condition)
+        ).scalars().all()
+        for user_id in user_ids:
+            report.record({
+                "action": "role",
+                "user_id": user_id,
+                "role": new_role.value,
+            })
+        if user_ids:
+            db.execute(
+                update(User)
+                .where(User.id.in_(user_ids))
+                .values(role=new_role)
+                .execution_options(synchronize_session=False)
+            )
+            record_role_changes(
+                db, {user_id: new_role for user_id in user_ids}, source="reconcile", bulk=True
+            )
+        if new_role == UserRole.PREMIUM:
+            report.upgraded += len(user_ids)
+        else:
+            report.downgraded += len(user_ids)
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, SubscriptionStatus):
+        return value.value
+    return value
+
+
+def reconcile(
+    db: Session,
+    dry_run: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    checkpoint_path: Optional[str] = None,
+    diff_file: Optional[TextIO] = None,
+) -> ReconcileReport:
+    """
+    Reconcile all Stripe subscriptions into the database.
+
+    Each chunk is committed together with its checkpoint so an interrupted run
+    resumes where it stopped. A dry run applies the same statements inside a
+    single transaction and rolls it back, so the report is exact but nothing
+    (including the checkpoint) is persisted.
+    """
+    report = ReconcileReport(dry_run=dry_run, diff_file=diff_file)
+    checkpoint = Checkpoint(None if dry_run else checkpoint_path)
+    chunk: list = []
+    last_seen: dict = {}
+    finished: set = set()
+
+    def flush():
+        if chunk:
+            _apply_chunk(db, chunk, report)
+            report.scanned += len(chunk)
+            chunk.clear()
+        if dry_run:
+            return
+        db.commit()
+        checkpoint.cursors.update(last_seen)
+        checkpoint.completed.update(finished)
+        checkpoint.save()
+        last_seen.clear()
+        finished.clear()
+
+    try:
+        for status, item in stream_subscriptions(checkpoint, concurrency, chunk_size):
+            if item is _DONE:
+                finished.add(status)
+                continue
+            chunk.append(item)
+            last_seen[status] = item["id"]
+            if len(chunk) >= chunk_size:
+                flush()
+        flush()
+
+        _sync_roles(db, report)
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+            checkpoint.clear()
+    except Exception:
+        db.rollback()
+        raise
+
+    return report
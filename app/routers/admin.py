@@ -0,0 +1,264 @@
+import csv
+import io
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.database import get_db, SessionLocal
+from app.models import ImportJob, User, UserRole, Subscription, SubscriptionStatus
+from app.auth import require_role
+from app.importer import start_import_job
+from app.token_versions import revoke_user_tokens
+from app.usage import stripe_usage_export
+from app.audit import audit_log, format_events, query_events
+from app.schemas import UserResponse, SubscriptionResponse, UserPage, SubscriptionPage
+
+router = APIRouter(dependencies=[Depends(require_role([UserRole.ADMIN]))])
+
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _user_filters(role: Optional[UserRole]) -> list:
+    return [User.role == role] if role else []
+
+
+def _subscription_filters(
+    status: Optional[SubscriptionStatus], plan: Optional[str]
+) -> list:
+    filters = []
+    if status:
+        filters.append(Subscription.status == status)
+    if plan:
+        filters.append(Subscription.plan_name == plan)
+    return filters
+
+
+def _columns(model, schema) -> list:
+    """Table columns backing the fields of a response schema"""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+def _keyset_page(db: Session, model, schema, filters: list, after: Optional[int], limit: int) -> dict:
+    """Fetch one page ordered by id, starting after the given cursor"""
+    query = select(*_columns(model, schema)).where(*filters)
+    if after is not None:
+        query = query.where(model.id > after)
+    # Fetch one extra row to know whether another page exists
+    rows = db.execute(query.order_by(model.id).limit(limit + 1)).all()
+    items = [schema.model_validate(row) for row in rows[:limit]]
+    next_cursor = items[-1].id if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _export_rows(model, schema, filters: list, fmt: str):
+    """
+    Stream every matching row as CSV or NDJSON.
+
+    Uses its own session and a server-side cursor, so memory stays constant
+    no matter how many rows are exported.
+    """
+    fields = list(schema.model_fields)
+    query = (
+        select(*_columns(model, schema))
+        .where(*filters)
+        .order_by(model.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(fields)
+
+    db = SessionLocal()
+    try:
+        for partition in db.execute(query).partitions():
+            for row in partition:
+                data = schema.model_validate(row).model_dump(mode="json")
+                if fmt == "csv":
+                    writer.writerow([data[name] for name in fields])
+                else:
+                    buffer.write(json.dumps(data))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header only (or nothing) when there were no rows
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+def _export_response(model, schema, filters: list, fmt: str, name: str) -> StreamingResponse:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid export format")
+    return StreamingResponse(
+        _export_rows(model, schema, filters, fmt),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
+
+@router.get("/users", response_model=UserPage)
+async def list_users(
+    role: Optional[UserRole] = None,
+    after: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    """List users, optionally filtered by role, using keyset pagination"""
+    return _keyset_page(db, User, UserResponse, _user_filters(role), after, limit)
+
+
+@router.get("/users/export")
+async def export_users(
+    role: Optional[UserRole] = None,
+    format: str = "csv"
+):
+    """Export users as CSV or NDJSON"""
+    return _export_response(User, UserResponse, _user_filters(role), format, "users")
+
+
+def _import_job_response(job: ImportJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "report": job.report,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _save_upload(upload: UploadFile, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile("wb", suffix=suffix, delete=False) as f:
+        shutil.copyfileobj(upload.file, f)
+    return f.name
+
+
+@router.post("/users/import", status_code=202)
+async def import_users_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Queue a bulk import of users from an uploaded CSV or NDJSON file"""
+    filename = file.filename or ""
+    fmt = format or ("ndjson" if filename.endswith((".ndjson", ".jsonl")) else "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid import format")
+
+    # The upload is discarded after the request, so keep a copy for the job
+    path = await run_in_threadpool(_save_upload, file, f".{fmt}")
+    job = start_import_job(db, path, fmt, filename=filename or None)
+    return _import_job_response(job)
+
+
+@router.get("/users/import/{job_id}")
+async def import_job_status(job_id: str, db: Session = Depends(get_db)):
+    """Status and (running) report of a bulk import"""
+    job = db.get(ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return _import_job_response(job)
+
+
+@router.post("/users/{user_id}/revoke-tokens")
+async def revoke_tokens(user_id: int, db: Session = Depends(get_db)):
+    """Sign a user out everywhere by invalidating all their current tokens"""
+    user = db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    revoke_user_tokens(db, user.id, user.role)
+    db.commit()
+    return {"message": "Tokens revoked"}
+
+
+@router.get("/subscriptions", response_model=SubscriptionPage)
+async def list_subscriptions(
+    status: Optional[SubscriptionStatus] = None,
+    plan: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    """List subscriptions, optionally filtered by status and plan, using keyset pagination"""
+    filters = _subscription_filters(status, plan)
+    return _keyset_page(db, Subscription, SubscriptionResponse, filters, after, limit)
+
+
+@router.get("/subscriptions/export")
+async def export_subscriptions(
+    status: Optional[SubscriptionStatus] = None,
+    plan: Optional[str] = None,
+    format: str = "csv"
+):
+    """Export subscriptions as CSV or NDJSON"""
+    filters = _subscription_filters(status, plan)
+    return _export_response(Subscription, SubscriptionResponse, filters, format, "subscriptions")
+
+
+@router.get("/usage/export")
+async def export_usage(start: datetime, end: datetime):
+    """Export premium API usage per customer for Stripe metered billing (NDJSON)"""
+    def rows():
+        db = SessionLocal()
+        try:
+            for record in stripe_usage_export(db, start, end):
+                yield json.dumps(record) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        rows(),
+        media_type=EXPORT_FORMATS["ndjson"],
+        headers={"Content-Disposition": 'attachment; filename="usage.ndjson"'},
+    )
+
+
+@router.get("/audit/export")
+async def export_audit(
+    event_type: Optional[str] = None,
+    outcome: Optional[str] = None,
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    format: str = "ndjson"
+):
+    """Stream stored audit events, oldest first (database sink only)"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid export format")
+
+    def rows():
+        db = SessionLocal()
+        try:
+            events = query_events(db, event_type, outcome, user_id, since, until, EXPORT_BATCH_SIZE)
+            yield from format_events(events, format)
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        rows(),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="audit.{format}"'},
+    )
+
+
+@router.get("/audit/stats")
+async def audit_stats():
+    """This worker's audit buffer: pending, written and dropped events"""
+    return audit_log.stats()
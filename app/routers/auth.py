@@ -4,14 +4,15 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from app.database import get_db
+from app.audit import audit_log, client_ip
 from app.models import User, UserRole
 from app.schemas import UserRegister, UserLogin, Token, UserResponse
 from app.auth import (
     get_password_hash,
     authenticate_user,
-    create_access_token,
+    create_user_access_token,
     get_user_by_email,
-    get_current_user,
+    get_current_user_read,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from fastapi.templating import Jinja2Templates
@@ -46,6 +47,10 @@ async def register(
     # Check if user already exists
     existing_user = get_user_by_email(db, email)
     if existing_user:
+        audit_log.record(
+            "register", "failure", email=email, ip_address=client_ip(request),
+            reason="email_taken"
+        )
         return templates.TemplateResponse(
             "auth/register.html",
             {"request": request, "error": "Email already registered"},
@@ -62,11 +67,14 @@ async def register(
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    audit_log.record(
+        "register", user_id=new_user.id, email=new_user.email, ip_address=client_ip(request)
+    )
 
     # Auto-login after registration
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": new_user.email}, expires_delta=access_token_expires
+    access_token = create_user_access_token(
+        new_user, expires_delta=access_token_expires
     )
 
     response = RedirectResponse(url="/dashboard", status_code=303)
@@ -105,15 +113,18 @@ async def login(
     
     user = authenticate_user(db, email, password)
     if not user:
+        audit_log.record("login", "failure", email=email, ip_address=client_ip(request))
         return templates.TemplateResponse(
             "auth/login.html",
             {"request": request, "error": "Incorrect email or password"},
             status_code=401
         )
 
+    audit_log.record("login", user_id=user.id, email=user.email, ip_address=client_ip(request))
+
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+    access_token = create_user_access_token(
+        user, expires_delta=access_token_expires, db=db
     )
 
     response = RedirectResponse(url="/dashboard", status_code=303)
@@ -136,7 +147,7 @@ async def logout():
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: User = Depends(get_current_user_read)):
     """Get current user information"""
     return current_user
 
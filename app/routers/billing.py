@@ -1,15 +1,19 @@
 import stripe
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse, JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, joinedload
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 
-from app.database import get_db
+from app.database import get_db, mark_primary_sticky
 from app.models import User, Subscription, SubscriptionStatus
-from app.auth import get_current_user
+from app.auth import get_current_user, get_current_principal
 from app.models import UserRole
+from app.schemas import Principal
+from app.token_versions import record_role_changes, token_versions
+from app.events import event_stream
+from app.audit import audit_log, client_ip
 
 load_dotenv()
 
@@ -19,6 +23,13 @@ STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 router = APIRouter()
 
 
+def _set_role(db: Session, user: User, role: UserRole):
+    """Change a user's role and bump their token version so it applies at once"""
+    if user.role != role:
+        user.role = role
+        record_role_changes(db, {user.id: role}, source="webhook")
+
+
 @router.get("/checkout")
 async def create_checkout_session(
     plan: str = "monthly",  # monthly or annual
@@ -82,11 +93,30 @@ async def checkout_success(
             raise HTTPException(status_code=403, detail="Unauthorized")
 
         # Redirect to dashboard - webhook will handle subscription creation
-        return RedirectResponse(url="/dashboard?upgraded=true", status_code=303)
+        response = RedirectResponse(url="/dashboard?upgraded=true", status_code=303)
+        # The upgrade is written to the primary; don't read it back from a stale replica
+        mark_primary_sticky(response)
+        return response
     except stripe.error.StripeError:
         raise HTTPException(status_code=400, detail="Invalid session")
 
 
+@router.get("/events")
+async def billing_events(principal: Principal = Depends(get_current_principal)):
+    """Server-sent events announcing role changes (e.g. once checkout completes)"""
+    def current_role():
+        # The map holds the newest role once a change has been loaded
+        entry = token_versions.get(principal.id)
+        role = entry.role if entry else principal.role
+        return {"type": "role", "role": role.value}
+
+    return StreamingResponse(
+        event_stream(principal.id, initial=current_role),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.post("/webhook")
 async def stripe_webhook(
     request: Request,
@@ -101,10 +131,30 @@ async def stripe_webhook(
             payload, sig_header, STRIPE_WEBHOOK_SECRET
         )
     except ValueError:
+        audit_log.record("webhook", "invalid_payload", ip_address=client_ip(request))
         raise HTTPException(status_code=400, detail="Invalid payload")
     except stripe.error.SignatureVerificationError:
+        audit_log.record("webhook", "invalid_signature", ip_address=client_ip(request))
         raise HTTPException(status_code=400, detail="Invalid signature")
 
+    try:
+        processed = _handle_webhook_event(db, event)
+    except Exception as exc:
+        audit_log.record(
+            "webhook", "error",
+            stripe_event=event["type"], event_id=event.get("id"), error=repr(exc)
+        )
+        raise
+    audit_log.record(
+        "webhook", "processed" if processed else "ignored",
+        stripe_event=event["type"], event_id=event.get("id")
+    )
+
+    return JSONResponse({"status": "success"})
+
+
+def _handle_webhook_event(db: Session, event) -> bool:
+    """Apply a verified Stripe event; returns False if it changed nothing"""
     # Handle different event types
     if event["type"] == "checkout.session.completed":
         session = event["data"]["object"]
@@ -136,12 +186,16 @@ async def stripe_webhook(
                     db_subscription.current_period_end = datetime.fromtimestamp(subscription.current_period_end)
                 
                 # Update user role to premium
-                user.role = UserRole.PREMIUM
+                _set_role(db, user, UserRole.PREMIUM)
                 db.commit()
+                return True
 
     elif event["type"] == "customer.subscription.updated":
         subscription = event["data"]["object"]
-        db_subscription = db.query(Subscription).filter(
+        # Load the user in the same query; the handler always updates its role
+        db_subscription = db.query(Subscription).options(
+            joinedload(Subscription.user)
+        ).filter(
             Subscription.stripe_subscription_id == subscription.id
         ).first()
         
@@ -153,24 +207,29 @@ async def stripe_webhook(
             # Update user role based on subscription status
             user = db_subscription.user
             if subscription.status == "active":
-                user.role = UserRole.PREMIUM
+                _set_role(db, user, UserRole.PREMIUM)
             elif subscription.status in ["canceled", "past_due", "unpaid"]:
-                user.role = UserRole.FREE
+                _set_role(db, user, UserRole.FREE)
             
             db.commit()
+            return True
 
     elif event["type"] == "customer.subscription.deleted":
         subscription = event["data"]["object"]
-        db_subscription = db.query(Subscription).filter(
+        # Load the user in the same query; the handler always updates its role
+        db_subscription = db.query(Subscription).options(
+            joinedload(Subscription.user)
+        ).filter(
             Subscription.stripe_subscription_id == subscription.id
         ).first()
         
         if db_subscription:
             db_subscription.status = SubscriptionStatus.CANCELED
-            db_subscription.user.role = UserRole.FREE
+            _set_role(db, db_subscription.user, UserRole.FREE)
             db.commit()
+            return True
 
-    return JSONResponse({"status": "success"})
+    return False
 
 
 @router.post("/cancel")
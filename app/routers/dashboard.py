@@ -1,37 +1,67 @@
+import hashlib
+from typing import Optional
+
 from fastapi import APIRouter, Depends, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
 
-from app.database import get_db
 from app.models import User, Subscription, SubscriptionStatus
-from app.auth import get_current_user
+from app.auth import get_current_user_with_subscription
 from app.schemas import DashboardResponse
 
 templates = Jinja2Templates(directory="app/templates")
 router = APIRouter()
 
 
-@router.get("", response_class=HTMLResponse)
-async def dashboard(
-    request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """User dashboard"""
-    # Get user's subscription
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id
-    ).order_by(Subscription.created_at.desc()).first()
+def _is_premium(user: User, subscription: Optional[Subscription]) -> bool:
+    """Effective premium flag for the dashboard"""
+    is_premium = user.role.value in ["premium", "admin"]
 
-    is_premium = current_user.role.value in ["premium", "admin"]
-    
     # Check if subscription is actually active
     if subscription and subscription.status == SubscriptionStatus.ACTIVE:
         is_premium = True
     elif subscription and subscription.status != SubscriptionStatus.ACTIVE:
         is_premium = False
 
+    return is_premium
+
+
+def _entity_tag(user: User, subscription: Optional[Subscription]) -> str:
+    """ETag from the versions of the rows the dashboard is built from"""
+    # Role and billing state are included because updated_at has one-second
+    # resolution on some databases
+    parts = [user.id, user.role.value, user.updated_at or user.created_at]
+    if subscription:
+        parts += [
+            subscription.id,
+            subscription.status.value,
+            subscription.cancel_at_period_end,
+            subscription.updated_at or subscription.created_at,
+        ]
+    digest = hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or any(
+        value.removeprefix("W/") == etag for value in candidates
+    )
+
+
+@router.get("", response_class=HTMLResponse)
+async def dashboard(
+    request: Request,
+    user_and_subscription: tuple = Depends(get_current_user_with_subscription)
+):
+    """User dashboard"""
+    # User and latest subscription come from one query
+    current_user, subscription = user_and_subscription
+    is_premium = _is_premium(current_user, subscription)
+
     context = {
         "request": request,
         "user": current_user,
@@ -42,3 +72,24 @@ async def dashboard(
 
     return templates.TemplateResponse("dashboard.html", context)
 
+
+@router.get("/api", response_model=DashboardResponse)
+async def dashboard_api(
+    request: Request,
+    response: Response,
+    user_and_subscription: tuple = Depends(get_current_user_with_subscription)
+):
+    """Dashboard data as JSON; supports conditional GET via ETag"""
+    current_user, subscription = user_and_subscription
+
+    etag = _entity_tag(current_user, subscription)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return DashboardResponse(
+        user=current_user,
+        subscription=subscription,
+        is_premium=_is_premium(current_user, subscription)
+    )
@@ -1,11 +1,20 @@
+from datetime import datetime
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 
-from app.database import get_db
-from app.models import User, UserRole, Subscription, SubscriptionStatus
-from app.auth import get_current_user, require_role
+from app.database import get_read_db
+from app.models import User
+from app.auth import (
+    get_current_user_read,
+    get_current_user_with_active_subscription,
+    has_premium_access,
+)
+from app.quotas import enforce_quota
+from app.usage import GRANULARITY_MINUTES, usage_meter, usage_rollup
 
 templates = Jinja2Templates(directory="app/templates")
 router = APIRouter()
@@ -14,20 +23,13 @@ router = APIRouter()
 @router.get("/features", response_class=HTMLResponse)
 async def premium_features(
     request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user_and_subscription: tuple = Depends(get_current_user_with_active_subscription)
 ):
     """Premium features page - accessible to premium users only"""
-    # Check if user has active premium subscription
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id,
-        Subscription.status == SubscriptionStatus.ACTIVE
-    ).first()
+    # User and active subscription come from one query
+    current_user, subscription = user_and_subscription
 
-    is_premium = (
-        current_user.role in [UserRole.PREMIUM, UserRole.ADMIN] or
-        (subscription and subscription.status == SubscriptionStatus.ACTIVE)
-    )
+    is_premium = has_premium_access(current_user, subscription)
 
     if not is_premium:
         return templates.TemplateResponse(
@@ -50,27 +52,17 @@ async def premium_features(
     )
 
 
-@router.get("/api/data")
+@router.get("/api/data", dependencies=[Depends(enforce_quota)])
 async def premium_api_data(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user_and_subscription: tuple = Depends(get_current_user_with_active_subscription)
 ):
     """Premium API endpoint - returns data only for premium users"""
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id,
-        Subscription.status == SubscriptionStatus.ACTIVE
-    ).first()
-
-    is_premium = (
-        current_user.role in [UserRole.PREMIUM, UserRole.ADMIN] or
-        (subscription and subscription.status == SubscriptionStatus.ACTIVE)
-    )
+    # enforce_quota has already rejected non-premium callers (with the same
+    # cached user and subscription), before charging their quota
+    current_user, _ = user_and_subscription
 
-    if not is_premium:
-        raise HTTPException(
-            status_code=403,
-            detail="Premium subscription required"
-        )
+    # Billable call; counted in memory and flushed in batches
+    usage_meter.record(current_user.id)
 
     return {
         "message": "Welcome to premium features!",
@@ -82,3 +74,25 @@ async def premium_api_data(
         }
     }
 
+
+@router.get("/api/usage")
+async def premium_api_usage(
+    granularity: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user_read),
+    db: Session = Depends(get_read_db)
+):
+    """Current user's premium API usage, rolled up by hour or day (UTC)"""
+    if granularity not in GRANULARITY_MINUTES:
+        raise HTTPException(status_code=400, detail="Invalid granularity")
+
+    buckets = [
+        {"period_start": row["period_start"], "count": row["count"]}
+        for row in usage_rollup(db, current_user.id, granularity, start, end)
+    ]
+    return {
+        "granularity": granularity,
+        "total": sum(bucket["count"] for bucket in buckets),
+        "usage": buckets,
+    }
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from app.models import UserRole, SubscriptionStatus
 
 
@@ -22,6 +22,17 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    user_id: Optional[int] = None
+    role: Optional[UserRole] = None
+    version: int = 0
+
+
+class Principal(BaseModel):
+    """Authenticated caller as resolved from the token, without a database read"""
+    id: int
+    email: str
+    role: UserRole
+    token_version: int
 
 
 # User schemas
@@ -49,6 +60,17 @@ class SubscriptionResponse(BaseModel):
         from_attributes = True
 
 
+# Admin schemas
+class UserPage(BaseModel):
+    items: List[UserResponse]
+    next_cursor: Optional[int] = None
+
+
+class SubscriptionPage(BaseModel):
+    items: List[SubscriptionResponse]
+    next_cursor: Optional[int] = None
+
+
 class DashboardResponse(BaseModel):
     user: UserResponse
     subscription: Optional[SubscriptionResponse] = None
@@ -0,0 +1,141 @@
+"""
+Background job that downgrades subscriptions which lapsed without a webhook.
+
+A subscription set to cancel at period end stays ACTIVE locally until Stripe's
+`customer.subscription.deleted` webhook arrives. The sweeper closes that gap:
+it finds lapsed rows through the `ix_subscriptions_expiring` index and cancels them
+(and downgrades their users) with set-based UPDATEs, one batch per transaction.
+A database lease ensures only one worker sweeps at a time.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import JobLease, User, UserRole, Subscription, SubscriptionStatus
+from app.token_versions import record_role_changes
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL_SECONDS = int(os.getenv("EXPIRY_SWEEP_INTERVAL_SECONDS", "300"))
+SWEEP_BATCH_SIZE = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", "500"))
+LEASE_NAME = "expiry_sweeper"
+LEASE_SECONDS = max(SWEEP_INTERVAL_SECONDS * 2, 60)
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_lease(db: Session, name: str, holder: str, seconds: int) -> bool:
+    """Take or renew a lease; returns False if another holder owns it"""
+    # Naive local time, matching how the billing webhooks store timestamps
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=seconds)
+    result = db.execute(
+        update(JobLease)
+        .where(
+            JobLease.name == name,
+            (JobLease.holder == holder) | (JobLease.expires_at < now),
+        )
+        .values(holder=holder, expires_at=expires_at)
+    )
+    if result.rowcount:
+        db.commit()
+        return True
+    try:
+        db.execute(insert(JobLease).values(name=name, holder=holder, expires_at=expires_at))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+
+def release_lease(db: Session, name: str, holder: str):
+    """Expire a lease early so another worker can pick the job up"""
+    db.execute(
+        update(JobLease)
+        .where(JobLease.name == name, JobLease.holder == holder)
+        .values(expires_at=datetime.now())
+    )
+    db.commit()
+
+
+def sweep_expired(db: Session, batch_size: int = SWEEP_BATCH_SIZE, now: datetime = None) -> int:
+    """Cancel lapsed subscriptions and downgrade their users; returns rows swept"""
+    now = now or datetime.now()
+    has_active = exists().where(
+        Subscription.user_id == User.id,
+        Subscription.status == SubscriptionStatus.ACTIVE,
+    )
+    swept = 0
+    while True:
+        rows = db.execute(
+            select(Subscription.id, Subscription.user_id)
+            .where(
+                Subscription.current_period_end < now,
+                Subscription.status == SubscriptionStatus.ACTIVE,
+                # Bare column rather than IS TRUE, which PostgreSQL cannot match to the index
+                Subscription.cancel_at_period_end,
+            )
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        subscription_ids = [row.id for row in rows]
+        user_ids = {row.user_id for row in rows}
+        db.execute(
+            update(Subscription)
+            .where(Subscription.id.in_(subscription_ids))
+            .values(status=SubscriptionStatus.CANCELED)
+            .execution_options(synchronize_session=False)
+        )
+        # Users keep premium if they still have another active subscription
+        downgraded = db.execute(
+            select(User.id).where(User.id.in_(user_ids), User.role == UserRole.PREMIUM, ~has_active)
+        ).scalars().all()
+        if downgraded:
+            db.execute(
+                update(User)
+                .where(User.id.in_(downgraded))
+                .values(role=UserRole.FREE)
+                .execution_options(synchronize_session=False)
+            )
+            record_role_changes(
+                db, {user_id: UserRole.FREE for user_id in downgraded}, source="expiry_sweeper", bulk=True
+            )
+        db.commit()
+        swept += len(rows)
+        if len(rows) < batch_size:
+            break
+    return swept
+
+
+def run_sweep() -> int:
+    """Run one sweep if this worker holds (or can take) the lease"""
+    db = SessionLocal()
+    try:
+        if not acquire_lease(db, LEASE_NAME, HOLDER_ID, LEASE_SECONDS):
+            return 0
+        swept = sweep_expired(db)
+        if swept:
+            logger.info("Expiry sweep downgraded %d subscriptions", swept)
+        return swept
+    finally:
+        db.close()
+
+
+async def sweeper_loop():
+    """Run the sweep every SWEEP_INTERVAL_SECONDS until cancelled"""
+    while True:
+        try:
+            await asyncio.to_thread(run_sweep)
+        except Exception:
+            logger.exception("Expiry sweep failed")
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
@@ -0,0 +1,238 @@
+"""
+Per-user token versions, so authorization can skip the database.
+
+Access tokens carry the user's id, role and token version. A row in
+`token_versions` exists only for users whose role changed (or whose tokens
+were revoked) since signup; every worker mirrors the table in memory. Writers
+bump the row in the same transaction as the change, and the committing worker
+reloads it immediately; other workers pick it up on their next poll.
+
+Polls select rows by `updated_at`, so it is re-stamped just before the
+transaction commits: a long batch transaction (reconciliation, the sweeper)
+would otherwise commit rows stamped when it started, behind pollers that
+had already moved past that time.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.audit import audit_entry, audit_log, record_in_transaction
+from app.database import SessionLocal
+from app.events import event_bus
+from app.models import TokenVersion, UserRole
+
+logger = logging.getLogger(__name__)
+
+TOKEN_VERSION_SYNC_SECONDS = int(os.getenv("TOKEN_VERSION_SYNC_SECONDS", "5"))
+# Re-read rows this far back on each poll to tolerate clock skew between
+# workers and the gap between the commit-time stamp and the commit itself
+_SYNC_OVERLAP = timedelta(seconds=10)
+_LOAD_CHUNK_SIZE = 1000
+
+
+class VersionEntry(NamedTuple):
+    version: int
+    role: UserRole
+    revoked_below: int
+
+
+class TokenVersionMap:
+    """In-memory copy of token_versions"""
+
+    def __init__(self):
+        self._entries: dict = {}
+        self._synced_until: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[VersionEntry]:
+        return self._entries.get(user_id)
+
+    def current_version(self, user_id: int) -> int:
+        entry = self._entries.get(user_id)
+        return entry.version if entry else 0
+
+    def load(self, db: Session, user_ids: Optional[Iterable[int]] = None):
+        """Reload the given users, or rows changed since the last load"""
+        query = select(
+            TokenVersion.user_id,
+            TokenVersion.version,
+            TokenVersion.role,
+            TokenVersion.revoked_below,
+            TokenVersion.updated_at,
+        )
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            for start in range(0, len(user_ids), _LOAD_CHUNK_SIZE):
+                chunk = user_ids[start:start + _LOAD_CHUNK_SIZE]
+                self._apply(db.execute(query.where(TokenVersion.user_id.in_(chunk))))
+            return
+
+        if self._synced_until is not None:
+            query = query.where(TokenVersion.updated_at >= self._synced_until - _SYNC_OVERLAP)
+        latest = self._apply(db.execute(query))
+        if latest is not None:
+            self._synced_until = max(latest, self._synced_until or latest)
+        elif self._synced_until is None:
+            self._synced_until = datetime.utcnow()
+
+    def _apply(self, rows) -> Optional[datetime]:
+        """Merge rows into the map; returns the newest updated_at seen"""
+        latest = None
+        changed = []
+        with self._lock:
+            for row in rows:
+                current = self._entries.get(row.user_id)
+                # Never go backwards if a poll races a fresher reload
+                if current is None or row.version >= current.version:
+                    self._entries[row.user_id] = VersionEntry(
+                        row.version, row.role, row.revoked_below
+                    )
+                    if current is None or row.version > current.version:
+                        changed.append((row.user_id, row.role))
+                if latest is None or row.updated_at > latest:
+                    latest = row.updated_at
+        # Notify open event streams (see app/events.py) outside the lock
+        for user_id, role in changed:
+            event_bus.publish(user_id, {"type": "role", "role": role.value})
+        return latest
+
+
+token_versions = TokenVersionMap()
+
+
+def _reload_after_commit(user_ids: list):
+    def reload(session):
+        db = SessionLocal()
+        try:
+            token_versions.load(db, user_ids)
+        finally:
+            db.close()
+    return reload
+
+
+def _stamp_before_commit(user_ids: list):
+    def stamp(session):
+        now = datetime.utcnow()
+        for start in range(0, len(user_ids), _LOAD_CHUNK_SIZE):
+            chunk = user_ids[start:start + _LOAD_CHUNK_SIZE]
+            session.execute(
+                update(TokenVersion)
+                .where(TokenVersion.user_id.in_(chunk))
+                .values(updated_at=now)
+            )
+    return stamp
+
+
+def _bump(db: Session, values: list, revoke: bool):
+    """Increment versions for the given rows (inserting them if missing)"""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert(TokenVersion)
+        set_ = {
+            "version": TokenVersion.version + 1,
+            "updated_at": statement.excluded.updated_at,
+        }
+        if revoke:
+            set_["revoked_below"] = TokenVersion.version + 1
+        else:
+            set_["role"] = statement.excluded.role
+        db.execute(
+            statement.on_conflict_do_update(index_elements=[TokenVersion.user_id], set_=set_),
+            values,
+        )
+        return
+
+    # Portable fallback: bump existing rows, insert the rest
+    by_user = {value["user_id"]: value for value in values}
+    existing = set(db.execute(
+        select(TokenVersion.user_id).where(TokenVersion.user_id.in_(list(by_user)))
+    ).scalars())
+    for user_id in existing:
+        changes = {"version": TokenVersion.version + 1, "updated_at": by_user[user_id]["updated_at"]}
+        if revoke:
+            changes["revoked_below"] = TokenVersion.version + 1
+        else:
+            changes["role"] = by_user[user_id]["role"]
+        db.execute(update(TokenVersion).where(TokenVersion.user_id == user_id).values(**changes))
+    missing = [value for user_id, value in by_user.items() if user_id not in existing]
+    if missing:
+        db.execute(TokenVersion.__table__.insert(), missing)
+
+
+def _audit_after_commit(event_type: str, roles: dict, **details):
+    def audit(session):
+        for user_id, role in roles.items():
+            audit_log.record(event_type, user_id=user_id, role=role.value, **details)
+    return audit
+
+
+def record_role_changes(
+    db: Session, roles: dict, source: Optional[str] = None, bulk: bool = False
+):
+    """
+    Record new roles ({user_id: UserRole}) as part of the caller's transaction.
+
+    Existing tokens for these users keep working but resolve to the new role;
+    this worker's map is refreshed (and the change audited) as soon as the
+    caller commits. Batch jobs pass bulk=True so their audit rows are written
+    in the same transaction instead of through the bounded audit buffer.
+    """
+    if not roles:
+        return
+    now = datetime.utcnow()
+    _bump(
+        db,
+        [
+            {"user_id": user_id, "version": 1, "role": role, "revoked_below": 0, "updated_at": now}
+            for user_id, role in roles.items()
+        ],
+        revoke=False,
+    )
+    event.listen(db, "before_commit", _stamp_before_commit(list(roles)), once=True)
+    event.listen(db, "after_commit", _reload_after_commit(list(roles)), once=True)
+    if bulk:
+        record_in_transaction(db, [
+            audit_entry("role_change", user_id=user_id, role=role.value, source=source)
+            for user_id, role in roles.items()
+        ])
+    else:
+        event.listen(db, "after_commit", _audit_after_commit("role_change", roles, source=source), once=True)
+
+
+def revoke_user_tokens(db: Session, user_id: int, role: UserRole):
+    """Invalidate every token issued to a user so far (caller commits)"""
+    _bump(
+        db,
+        [{"user_id": user_id, "version": 1, "role": role, "revoked_below": 1, "updated_at": datetime.utcnow()}],
+        revoke=True,
+    )
+    event.listen(db, "before_commit", _stamp_before_commit([user_id]), once=True)
+    event.listen(db, "after_commit", _reload_after_commit([user_id]), once=True)
+    event.listen(db, "after_commit", _audit_after_commit("tokens_revoked", {user_id: role}), once=True)
+
+
+def sync_token_versions():
+    db = SessionLocal()
+    try:
+        token_versions.load(db)
+    finally:
+        db.close()
+
+
+async def token_version_sync_loop():
+    """Pick up version changes made by other workers until cancelled"""
+    while True:
+        await asyncio.sleep(TOKEN_VERSION_SYNC_SECONDS)
+        try:
+            await asyncio.to_thread(sync_token_versions)
+        except Exception:
+            logger.exception("Token version sync failed")
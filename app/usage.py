@@ -0,0 +1,287 @@
+"""
+Usage metering for the premium API.
+
+Calls are counted in memory per (user, minute) and flushed to `usage_records`
+periodically with one batched upsert, so metering never adds a database write
+to the request path. The same transaction adds the counts to per-user hourly,
+daily and monthly totals in `usage_totals`, which usage rollups and quota
+checks read instead of scanning minutes. Each worker flushes its own counts;
+upserts add to any existing row, so multiple workers aggregate correctly.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import User, UsageRecord, UsageTotal
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_SECONDS = int(os.getenv("USAGE_FLUSH_SECONDS", "10"))
+GRANULARITY_MINUTES = {"minute": 1, "hour": 60, "day": 1440}
+
+# Counts are keyed by a single int packing (user_id, minute), which keeps the
+# pending map small and cheap to hash
+_MINUTE_BITS = 32
+_MINUTE_MASK = (1 << _MINUTE_BITS) - 1
+
+
+class UsageMeter:
+    """In-memory per-user, per-minute call counters"""
+
+    def __init__(self):
+        self._counts: dict = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id: int, amount: int = 1, now: Optional[float] = None):
+        minute = int((now or time.time()) // 60)
+        key = (user_id << _MINUTE_BITS) | minute
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + amount
+
+    def drain(self) -> list:
+        """Take all pending counts as (user_id, minute, count) rows"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return [
+            (key >> _MINUTE_BITS, key & _MINUTE_MASK, count)
+            for key, count in counts.items()
+        ]
+
+    def restore(self, rows: list):
+        """Put rows back after a failed flush so they are retried"""
+        with self._lock:
+            for user_id, minute, count in rows:
+                key = (user_id << _MINUTE_BITS) | minute
+                self._counts[key] = self._counts.get(key, 0) + count
+
+
+usage_meter = UsageMeter()
+
+
+@functools.lru_cache(maxsize=4096)
+def month_start_minute(minute: int) -> int:
+    """First minute of the UTC calendar month containing `minute`"""
+    current = datetime.fromtimestamp(minute * 60, tz=timezone.utc)
+    start = current.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return int(start.timestamp() // 60)
+
+
+def _add_counts(db: Session, model, keys: tuple, values: list):
+    """Upsert rows of `model`, adding `count` to any row with the same key columns"""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert(model)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[getattr(model, key) for key in keys],
+                set_={"count": model.count + statement.excluded.count},
+            ),
+            values,
+        )
+        return
+
+    # Portable fallback: update existing rows in bulk, insert the rest
+    pending = {tuple(value[key] for key in keys): value for value in values}
+    columns = [getattr(model, key) for key in keys]
+    existing = db.execute(
+        select(model.id, model.count, *columns)
+        .where(*[column.in_({k[i] for k in pending}) for i, column in enumerate(columns)])
+    ).all()
+    updates = []
+    for row in existing:
+        value = pending.pop(tuple(getattr(row, key) for key in keys), None)
+        if value:
+            updates.append({"id": row.id, "count": row.count + value["count"]})
+    if updates:
+        db.execute(update(model), updates)
+    if pending:
+        db.execute(model.__table__.insert(), list(pending.values()))
+
+
+def _upsert(db: Session, rows: list):
+    _add_counts(
+        db,
+        UsageRecord,
+        ("user_id", "minute"),
+        [{"user_id": u, "minute": m, "count": c} for u, m, c in rows],
+    )
+    totals: dict = {}
+    for user_id, minute, count in rows:
+        for key in _total_keys(user_id, minute):
+            totals[key] = totals.get(key, 0) + count
+    _add_counts(
+        db,
+        UsageTotal,
+        ("user_id", "period", "period_start"),
+        [
+            {"user_id": u, "period": period, "period_start": start, "count": c}
+            for (u, period, start), c in totals.items()
+        ],
+    )
+
+
+def _total_keys(user_id: int, minute: int) -> tuple:
+    """usage_totals keys (user_id, period, period_start) a minute counts towards"""
+    return (
+        (user_id, "hour", minute - minute % GRANULARITY_MINUTES["hour"]),
+        (user_id, "day", minute - minute % GRANULARITY_MINUTES["day"]),
+        (user_id, "month", month_start_minute(minute)),
+    )
+
+
+def rebuild_usage_totals(db: Session, batch_size: int = 5000) -> int:
+    """
+    Recompute usage_totals from usage_records (caller commits); returns rows written.
+
+    Needed once for usage recorded before usage_totals existed. On PostgreSQL
+    usage_records is locked against writes until commit, so a flush running
+    meanwhile is neither missed nor counted twice; SQLite serialises writers.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE usage_records IN SHARE MODE"))
+    db.execute(delete(UsageTotal))
+    hour = UsageRecord.minute // 60
+    query = (
+        select(
+            UsageRecord.user_id,
+            (hour * 60).label("minute"),
+            func.sum(UsageRecord.count).label("count"),
+        )
+        .group_by(UsageRecord.user_id, hour)
+        .order_by(UsageRecord.user_id, hour)
+    )
+    written = 0
+
+    def write(totals: dict):
+        nonlocal written
+        values = [
+            {"user_id": u, "period": period, "period_start": start, "count": c}
+            for (u, period, start), c in totals.items()
+        ]
+        for offset in range(0, len(values), batch_size):
+            db.execute(UsageTotal.__table__.insert(), values[offset:offset + batch_size])
+        written += len(values)
+
+    # One user's hours at a time, so memory stays bounded
+    totals: dict = {}
+    current_user = None
+    for row in db.execute(query.execution_options(yield_per=batch_size)):
+        if row.user_id != current_user and totals:
+            write(totals)
+            totals = {}
+        current_user = row.user_id
+        for key in _total_keys(row.user_id, int(row.minute)):
+            totals[key] = totals.get(key, 0) + int(row.count)
+    if totals:
+        write(totals)
+    return written
+
+
+def flush_usage(meter: UsageMeter = usage_meter) -> int:
+    """Write pending counts in one transaction; returns rows written"""
+    rows = meter.drain()
+    if not rows:
+        return 0
+    db = SessionLocal()
+    try:
+        _upsert(db, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        meter.restore(rows)
+        raise
+    finally:
+        db.close()
+    return len(rows)
+
+
+async def usage_flush_loop():
+    """Flush usage every USAGE_FLUSH_SECONDS until cancelled"""
+    while True:
+        await asyncio.sleep(USAGE_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_usage)
+        except Exception:
+            logger.exception("Usage flush failed")
+
+
+def _to_minute(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() // 60)
+
+
+def usage_rollup(
+    db: Session,
+    user_id: Optional[int] = None,
+    granularity: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """
+    Call counts per user in minute/hour/day buckets (UTC) starting in [start, end).
+
+    Hours and days come from usage_totals; only the minute view reads
+    usage_records.
+    """
+    if granularity not in GRANULARITY_MINUTES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    if granularity == "minute":
+        table_user, bucket, count = UsageRecord.user_id, UsageRecord.minute, UsageRecord.count
+        query = select(table_user, bucket, count)
+    else:
+        table_user, bucket, count = UsageTotal.user_id, UsageTotal.period_start, UsageTotal.count
+        query = select(table_user, bucket, count).where(UsageTotal.period == granularity)
+    if user_id is not None:
+        query = query.where(table_user == user_id)
+    if start is not None:
+        query = query.where(bucket >= _to_minute(start))
+    if end is not None:
+        query = query.where(bucket < _to_minute(end))
+    query = query.order_by(table_user, bucket)
+
+    for row_user, row_bucket, row_count in db.execute(query):
+        yield {
+            "user_id": row_user,
+            "period_start": datetime.fromtimestamp(row_bucket * 60, tz=timezone.utc),
+            "count": row_count,
+        }
+
+
+def stripe_usage_export(db: Session, start: datetime, end: datetime):
+    """
+    Total calls per customer in [start, end), shaped like Stripe usage records.
+
+    Each item can be posted as a usage record (action=increment) against the
+    customer's metered subscription item.
+    """
+    query = (
+        select(User.id, User.stripe_customer_id, func.sum(UsageRecord.count).label("quantity"))
+        .join(User, User.id == UsageRecord.user_id)
+        .where(UsageRecord.minute >= _to_minute(start), UsageRecord.minute < _to_minute(end))
+        .group_by(User.id, User.stripe_customer_id)
+        .order_by(User.id)
+    )
+    timestamp = int(end.replace(tzinfo=end.tzinfo or timezone.utc).timestamp()) - 1
+    for row in db.execute(query):
+        yield {
+            "user_id": row.id,
+            "stripe_customer_id": row.stripe_customer_id,
+            "quantity": int(row.quantity),
+            "timestamp": timestamp,
+            "action": "increment",
+        }
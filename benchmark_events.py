@@ -0,0 +1,95 @@
+"""
+Benchmark idle event stream memory and role-change fan-out latency
+Usage: python benchmark_events.py [--connections 20000] [--publishes 1000]
+
+Opens the given number of event_stream generators (what /billing/events
+serves) in one event loop, each parked waiting for its next event, and
+reports the memory held per idle connection. Then publishes role changes,
+from a worker thread as the token version sync does, and reports the time
+until every stream of the user has produced the event. HTTP and socket
+buffers are not included; they depend on the server and the OS.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from app.events import event_bus, event_stream
+
+
+async def _consume(stream, received: list, ready: asyncio.Event):
+    try:
+        await stream.__anext__()  # retry hint
+        await stream.__anext__()  # initial state
+        ready.set()
+        async for message in stream:
+            if message.startswith("event:"):
+                received.append(time.perf_counter())
+                return
+    finally:
+        await stream.aclose()
+
+
+async def run(connections: int, publishes: int, fanout: int):
+    initial = lambda: {"type": "role", "role": "free"}  # noqa: E731
+    loop = asyncio.get_running_loop()
+
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    idle_tasks = []
+    for user_id in range(connections):
+        ready = asyncio.Event()
+        idle_tasks.append(asyncio.create_task(
+            _consume(event_stream(user_id, initial), [], ready)
+        ))
+    await asyncio.sleep(0.5)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in snapshot.compare_to(baseline, "filename"))
+    print(f"Idle connections: {event_bus.connection_count()}")
+    print(f"Memory: {used / 1024 / 1024:.1f} MiB total, {used / connections:.0f} bytes per connection")
+
+    # Fan-out: one user with several open tabs/devices
+    user_id = connections + 1
+    latencies = []
+    for _ in range(publishes):
+        received: list = []
+        readies = [asyncio.Event() for _ in range(fanout)]
+        tasks = [
+            asyncio.create_task(_consume(event_stream(user_id, initial), received, ready))
+            for ready in readies
+        ]
+        for ready in readies:
+            await ready.wait()
+        started = time.perf_counter()
+        await loop.run_in_executor(
+            None, event_bus.publish, user_id, {"type": "role", "role": "premium"}
+        )
+        await asyncio.gather(*tasks)
+        latencies.append(max(received) - started)
+
+    latencies.sort()
+    print(f"Fan-out to {fanout} streams, {publishes} publishes from a worker thread:")
+    print(f"  median {statistics.median(latencies) * 1e6:.0f}µs, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e6:.0f}µs")
+
+    for task in idle_tasks:
+        task.cancel()
+    await asyncio.gather(*idle_tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event streams")
+    parser.add_argument("--connections", type=int, default=20000)
+    parser.add_argument("--publishes", type=int, default=1000)
+    parser.add_argument("--fanout", type=int, default=5, help="Open streams per published user")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.connections, args.publishes, args.fanout))
+    print("[SUCCESS] Benchmark complete")
+
+
+if __name__ == "__main__":
+    main()
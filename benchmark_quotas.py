@@ -0,0 +1,39 @@
+"""
+Benchmark the per-request cost of quota enforcement
+Usage: python benchmark_quotas.py [--users 10000] [--calls 1000000]
+
+Measures the plan lookup and QuotaTracker.consume, the in-memory work that
+enforce_quota adds to every premium API call. The target is under 10µs per
+call.
+"""
+
+import argparse
+import random
+import time
+
+from app.quotas import PLAN_QUOTAS, QuotaTracker, quota_for_plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quota checks")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--calls", type=int, default=1000000)
+    args = parser.parse_args()
+
+    tracker = QuotaTracker()
+    plans = [random.choice(list(PLAN_QUOTAS)) for _ in range(args.users)]
+    user_ids = [random.randrange(args.users) for _ in range(args.calls)]
+
+    consume = tracker.consume
+    started = time.perf_counter()
+    for user_id in user_ids:
+        consume(user_id, quota_for_plan(plans[user_id]), time.time())
+    elapsed = time.perf_counter() - started
+
+    per_call_us = elapsed / args.calls * 1e6
+    print(f"{args.calls} checks across {args.users} users in {elapsed:.2f}s")
+    print(f"{per_call_us:.2f}µs per check ({'PASS' if per_call_us < 10 else 'FAIL'} < 10µs)")
+
+
+if __name__ == "__main__":
+    main()
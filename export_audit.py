@@ -0,0 +1,69 @@
+"""
+Query and export audit events
+Usage: python export_audit.py [--type login] [--outcome failure] [--user 42] [--since 2025-01-01] [--format csv] [--output audit.csv]
+
+Reads from the `audit_events` table, or from the rotated log files when the
+app runs with AUDIT_SINK=file (pass --files, optionally with --path). Events
+are written oldest first as NDJSON (default) or CSV, to stdout unless
+--output is given.
+"""
+
+import argparse
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from app.audit import AUDIT_LOG_PATH, AUDIT_SINK, format_events, query_events, read_log_files
+from app.database import SessionLocal
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and export audit events")
+    parser.add_argument("--type", dest="event_type", help="login, register, role_change, tokens_revoked, webhook")
+    parser.add_argument("--outcome", help="e.g. success, failure, processed, ignored, error")
+    parser.add_argument("--user", type=int, dest="user_id")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="ISO date/time (UTC), inclusive")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="ISO date/time (UTC), exclusive")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--output", help="Write to this file instead of stdout")
+    parser.add_argument("--files", action="store_true", default=AUDIT_SINK == "file",
+                        help="Read the rotated log files instead of the database")
+    parser.add_argument("--path", default=AUDIT_LOG_PATH, help="Base log file path (with --files)")
+    args = parser.parse_args()
+
+    filters = {
+        "event_type": args.event_type,
+        "outcome": args.outcome,
+        "user_id": args.user_id,
+        "since": args.since,
+        "until": args.until,
+    }
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    db = None if args.files else SessionLocal()
+    exported = 0
+
+    def counted(events):
+        nonlocal exported
+        for event in events:
+            exported += 1
+            yield event
+
+    try:
+        events = read_log_files(args.path, **filters) if args.files else query_events(db, **filters)
+        for chunk in format_events(counted(events), args.format):
+            output.write(chunk)
+    finally:
+        if db is not None:
+            db.close()
+        if args.output:
+            output.close()
+
+    if args.output:
+        print(f"[SUCCESS] Exported {exported} events to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
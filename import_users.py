@@ -0,0 +1,43 @@
+"""
+Bulk import users from a CSV or NDJSON file
+Usage: python import_users.py users.csv [--format csv|ndjson] [--workers 8]
+
+Each row needs `email` plus either `password` or a bcrypt `password_hash`;
+`role` is optional (free, premium, admin). Use - to read from stdin.
+"""
+
+import argparse
+import json
+import sys
+
+from app.database import Base, SessionLocal, engine
+from app.importer import DEFAULT_BATCH_SIZE, import_users, read_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import users")
+    parser.add_argument("path", help="CSV or NDJSON file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, help="Hashing processes (defaults to CPU count)")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    Base.metadata.create_all(bind=engine)
+
+    stream = sys.stdin if args.path == "-" else open(args.path, "r", newline="", encoding="utf-8")
+    db = SessionLocal()
+    try:
+        report = import_users(
+            db, read_rows(stream, fmt), batch_size=args.batch_size, workers=args.workers
+        )
+    finally:
+        db.close()
+        if stream is not sys.stdin:
+            stream.close()
+
+    print("[SUCCESS] " + json.dumps(report.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
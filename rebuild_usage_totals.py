@@ -0,0 +1,32 @@
+"""
+Rebuild hourly, daily and monthly usage totals from the per-minute records
+Usage: python rebuild_usage_totals.py
+
+The usage flush keeps `usage_totals` up to date as calls are recorded. Run
+this once on a database that recorded usage before that table existed (or
+after editing `usage_records` by hand); it is safe while the app is running.
+"""
+
+import time
+
+from dotenv import load_dotenv
+
+from app.database import SessionLocal
+from app.usage import rebuild_usage_totals
+
+load_dotenv()
+
+
+def main():
+    db = SessionLocal()
+    started = time.monotonic()
+    try:
+        written = rebuild_usage_totals(db)
+        db.commit()
+    finally:
+        db.close()
+    print(f"[SUCCESS] Rebuilt {written} usage totals in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Reconcile subscriptions and user roles with Stripe
+Usage: python reconcile_stripe.py [--dry-run] [--diff report.ndjson]
+
+Run it after missed webhooks, or on a schedule, to bring the `subscriptions`
+table and `users.role` back in line with Stripe. Interrupted runs resume from
+the checkpoint file. Point --api-base at stripe_stub_server.py to try it
+against synthetic data.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import stripe
+from dotenv import load_dotenv
+
+from app.database import SessionLocal
+from app.reconcile import DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY, reconcile
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile subscriptions with Stripe")
+    parser.add_argument("--dry-run", action="store_true", help="Report changes without writing them")
+    parser.add_argument("--diff", help="Write every change as NDJSON to this file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--checkpoint", default=".reconcile_checkpoint.json")
+    parser.add_argument("--api-base", help="Override the Stripe API base URL (e.g. a local stub)")
+    args = parser.parse_args()
+
+    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+    if args.api_base:
+        stripe.api_base = args.api_base
+        stripe.api_key = stripe.api_key or "sk_test_stub"
+    if not stripe.api_key:
+        print("[ERROR] STRIPE_SECRET_KEY is not set.")
+        return
+
+    diff_file = open(args.diff, "w") if args.diff else None
+    db = SessionLocal()
+    started = time.monotonic()
+    try:
+        report = reconcile(
+            db,
+            dry_run=args.dry_run,
+            chunk_size=args.chunk_size,
+            concurrency=args.concurrency,
+            checkpoint_path=args.checkpoint,
+            diff_file=diff_file,
+        )
+    finally:
+        db.close()
+        if diff_file:
+            diff_file.close()
+
+    elapsed = time.monotonic() - started
+    summary = report.as_dict()
+    summary["seconds"] = round(elapsed, 2)
+    print("[DRY RUN] " if args.dry_run else "[SUCCESS] ", end="")
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,9 @@ STRIPE_ANNUAL_PRICE_ID=price_your_annual_price_id
 ALGORITHM=HS256
 ACCESS_TOKEN_EXPIRE_MINUTES=30
 BASE_URL=http://localhost:8000
+
+# Background Jobs (seconds between expiry sweeps, 0 disables)
+EXPIRY_SWEEP_INTERVAL_SECONDS=300
 """
 
 # Write .env file
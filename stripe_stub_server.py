@@ -0,0 +1,101 @@
+"""
+Minimal local stand-in for the Stripe subscriptions list API
+Usage: python stripe_stub_server.py [--count 100000] [--port 12111]
+
+Serves GET /v1/subscriptions with Stripe-style cursor pagination over
+deterministic synthetic subscriptions, so reconcile_stripe.py can be
+exercised without a Stripe account:
+
+    python reconcile_stripe.py --dry-run --api-base http://localhost:12111
+"""
+
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+STATUSES = ["active", "active", "active", "canceled", "past_due", "trialing"]
+INTERVALS = ["month", "year"]
+
+
+def synthetic_subscription(index: int, now: int) -> dict:
+    return {
+        "id": f"sub_stub_{index:07d}",
+        "object": "subscription",
+        "customer": f"cus_stub_{index:07d}",
+        "status": STATUSES[index % len(STATUSES)],
+        "current_period_end": now + (index % 60) * 86400,
+        "cancel_at_period_end": index % 10 == 0,
+        "metadata": {},
+        "items": {
+            "object": "list",
+            "data": [{"price": {"recurring": {"interval": INTERVALS[index % 2]}}}],
+        },
+    }
+
+
+def build_index(count: int) -> dict:
+    """Subscription indexes grouped by status, in list order"""
+    by_status: dict = {}
+    for index in range(count):
+        by_status.setdefault(STATUSES[index % len(STATUSES)], []).append(index)
+    return by_status
+
+
+def make_handler(by_status: dict, now: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/v1/subscriptions":
+                self.send_error(404)
+                return
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            limit = min(int(query.get("limit", 10)), 100)
+            indexes = by_status.get(query.get("status", "active"), [])
+
+            start = 0
+            if query.get("starting_after"):
+                # Ids are zero-padded, so the position can be bisected
+                after = int(query["starting_after"].rsplit("_", 1)[1])
+                lo, hi = 0, len(indexes)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if indexes[mid] <= after:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                start = lo
+
+            page = indexes[start:start + limit]
+            body = json.dumps({
+                "object": "list",
+                "url": "/v1/subscriptions",
+                "has_more": start + limit < len(indexes),
+                "data": [synthetic_subscription(i, now) for i in page],
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic Stripe subscriptions")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--port", type=int, default=12111)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", args.port),
+        make_handler(build_index(args.count), int(time.time())),
+    )
+    print(f"Serving {args.count} synthetic subscriptions at http://127.0.0.1:{args.port}")
+    print("Press CTRL+C to stop the server\n")
+    server.serve_forever()
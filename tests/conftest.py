@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+# Configure the app before it is imported: a throwaway SQLite database and no
+# expiry sweeper
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["EXPIRY_SWEEP_INTERVAL_SECONDS"] = "0"
+os.environ["STRIPE_WEBHOOK_SECRET"] = "whsec_test"
+os.environ.pop("REPLICA_DATABASE_URLS", None)
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,94 @@
+"""Query budgets per route; a failure here usually means an N+1 crept in"""
+
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.auth import create_user_access_token
+from app.database import SessionLocal, assert_max_queries
+from app.models import Subscription, SubscriptionStatus, User, UserRole
+
+# Subscription webhook: load the subscription with its user, upsert the token
+# version, update the subscription and user rows, re-stamp the token version
+# at commit, then reload it after commit
+SUBSCRIPTION_WEBHOOK_QUERIES = 6
+
+
+@pytest.fixture(scope="module")
+def premium_user(client):
+    db = SessionLocal()
+    try:
+        user = User(
+            email="premium@example.com",
+            password_hash="x",
+            role=UserRole.PREMIUM,
+            stripe_customer_id="cus_query_counts",
+        )
+        db.add(user)
+        db.flush()
+        db.add(Subscription(
+            user_id=user.id,
+            stripe_subscription_id="sub_query_counts",
+            status=SubscriptionStatus.ACTIVE,
+            plan_name="monthly",
+            current_period_end=datetime.utcnow() + timedelta(days=30),
+        ))
+        db.commit()
+        db.refresh(user)
+        return user
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def auth_headers(premium_user):
+    return {"Authorization": f"Bearer {create_user_access_token(premium_user)}"}
+
+
+@pytest.mark.parametrize("path", [
+    "/dashboard",
+    "/dashboard/api",
+    "/premium/features",
+    "/premium/api/data",
+    "/auth/me",
+])
+def test_page_runs_one_query(client, auth_headers, path):
+    with assert_max_queries(1):
+        response = client.get(path, headers=auth_headers)
+    assert response.status_code == 200
+
+
+def _signed(payload: str) -> dict:
+    timestamp = int(time.time())
+    signature = hmac.new(
+        b"whsec_test", f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return {"stripe-signature": f"t={timestamp},v1={signature}"}
+
+
+def test_subscription_webhook_query_budget(client, premium_user):
+    payload = json.dumps({
+        "id": "evt_query_counts",
+        "object": "event",
+        "type": "customer.subscription.updated",
+        "data": {"object": {
+            "id": "sub_query_counts",
+            "object": "subscription",
+            "status": "past_due",
+            "current_period_end": int(time.time()) + 86400,
+            "cancel_at_period_end": False,
+        }},
+    })
+    with assert_max_queries(SUBSCRIPTION_WEBHOOK_QUERIES):
+        response = client.post("/billing/webhook", content=payload, headers=_signed(payload))
+    assert response.status_code == 200
+
+    db = SessionLocal()
+    try:
+        assert db.get(User, premium_user.id).role == UserRole.FREE
+    finally:
+        db.close()
@@ -0,0 +1,104 @@
+"""Token versions: revocation, role changes after issue, and stale worker maps"""
+
+import pytest
+from jose import jwt
+
+from app.auth import (
+    ALGORITHM,
+    SECRET_KEY,
+    create_access_token,
+    create_user_access_token,
+    get_password_hash,
+)
+from app.database import SessionLocal
+from app.models import User, UserRole
+from app.token_versions import record_role_changes, revoke_user_tokens, token_versions
+
+PASSWORD = "correct horse"
+
+
+def _create_user(email: str, role: UserRole) -> User:
+    db = SessionLocal()
+    try:
+        user = User(email=email, password_hash=get_password_hash(PASSWORD), role=role)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user
+    finally:
+        db.close()
+
+
+def _bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def user(client, request):
+    return _create_user(f"{request.node.name}@example.com", UserRole.FREE)
+
+
+def test_revoked_token_is_rejected(client, user):
+    token = create_user_access_token(user)
+    assert client.get("/auth/me", headers=_bearer(token)).status_code == 200
+
+    db = SessionLocal()
+    try:
+        revoke_user_tokens(db, user.id, user.role)
+        db.commit()
+    finally:
+        db.close()
+
+    assert client.get("/auth/me", headers=_bearer(token)).status_code == 401
+    fresh = create_user_access_token(user)
+    assert client.get("/auth/me", headers=_bearer(fresh)).status_code == 200
+
+
+def test_newer_version_overrides_token_role(client, user):
+    token = create_user_access_token(user)
+    assert client.get("/admin/audit/stats", headers=_bearer(token)).status_code == 403
+
+    db = SessionLocal()
+    try:
+        record_role_changes(db, {user.id: UserRole.ADMIN})
+        db.commit()
+    finally:
+        db.close()
+    assert client.get("/admin/audit/stats", headers=_bearer(token)).status_code == 200
+
+    db = SessionLocal()
+    try:
+        record_role_changes(db, {user.id: UserRole.FREE})
+        db.commit()
+    finally:
+        db.close()
+    assert client.get("/admin/audit/stats", headers=_bearer(token)).status_code == 403
+
+
+def test_token_without_uid_is_rejected(client, user):
+    token = create_access_token({"sub": user.email, "role": user.role.value})
+    assert client.get("/auth/me", headers=_bearer(token)).status_code == 401
+    assert client.get("/dashboard/api", headers=_bearer(token)).status_code == 401
+
+
+def test_login_reads_version_missed_by_this_worker(client, user):
+    db = SessionLocal()
+    try:
+        revoke_user_tokens(db, user.id, user.role)
+        db.commit()
+    finally:
+        db.close()
+    # As if the revocation happened on another worker and no poll has run yet
+    token_versions._entries.pop(user.id)
+
+    response = client.post(
+        "/auth/login",
+        data={"username": user.email, "password": PASSWORD},
+        follow_redirects=False,
+    )
+    token = response.cookies["access_token"]
+    client.cookies.clear()
+
+    assert response.status_code == 303
+    assert jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["ver"] == 1
+    assert client.get("/auth/me", headers=_bearer(token)).status_code == 200